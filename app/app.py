@@ -1,19 +1,56 @@
+import datetime
+from typing import Literal, Optional
+
 import fastapi
-from fastapi import HTTPException
-from sqlalchemy import select
+from fastapi import Depends, HTTPException, Query, Request
+from fastapi.responses import PlainTextResponse, StreamingResponse
+from sqlalchemy import exists, select
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import selectinload
 
 from lifespan import lifespan
 from schema import (
     AuthorSchema, UpdateAuthor, ItemId, StatusResponse, GenreSchema, BaseAuthor, 
     GetBook, AddBook, UpdateBook, CreateUser, BaseUser, GetUser, UpdateUser,
-    CreateAuthor, GetUserDetails
+    CreateAuthor, GetUserDetails, Page, ImportReport, RentalAction, RentalResult, CacheStats,
+    PoolStats, CatalogStats, GenreCount, AuthorCount, BookRentals, OverdueLoan, HealthStatus,
+    SimilarBook, SimilarStats, Suggestions, SuggestStats, ProfileSummary, ProfileReport,
+    BatchRequest, BatchResult
 )
 from dependencies import (
-    SessionDependency, UserAdminDependency, FiltersDependency, TokenDependency
+    SessionDependency, ReadSessionDependency, UserAdminDependency, FiltersDependency, TokenDependency,
+    AdmissionDependency,
+    PaginationDependency, BookQueryDependency, BookFieldsDependency, UserFieldsDependency
+)
+from models import Session, Author, Book, Genre, User, UserRole, book_user, engine, replica_engines
+from crud import (
+    get_item, get_items, add_item, paginate, on_commit, BOOK_RELATIONS, USER_BOOKS
+)
+from fieldsets import load_options
+from importer import BookImporter, book_values, iter_csv, iter_lines, iter_ndjson
+from export import MEDIA_TYPES, stream_books
+from cache import request_key, response_cache
+from overdue import OVERDUE_KEYS, overdue_query
+from serialize import (
+    author_record, book_record, json_response, name_record, page_encoder, user_details_record,
+    user_record, author_count_record, book_rentals_record, genre_count_record, overdue_record,
+    suggestions_record, fieldset_record
 )
-from models import Author, Book, Genre, User, UserRole
-from crud import get_item, add_item
+from pool_stats import pool_stats, pool_status
+from replicas import ReplicaPinMiddleware, replica_router
+from migrations import schema_state
+from similar import similar_books
+from batch import BatchOp, BatchRunner
+from suggest import suggest_index
+from config import (
+    IMPORT_BATCH_SIZE, EXPORT_BATCH_SIZE, METRICS_ENABLED, METRICS_SERVER_TIMING, MAX_PAGE_SIZE,
+    PROFILING_ENABLED, PROFILE_SAMPLE_RATE, PROFILE_MAX_QUERIES, MAX_BATCH_OPERATIONS
+)
+import metrics
+import profiling
 import auth
+import rentals
+import stats
 
 
 app = fastapi.FastAPI(
@@ -23,92 +60,149 @@ app = fastapi.FastAPI(
     lifespan = lifespan
 )
 
+if METRICS_ENABLED:
+    metrics.instrument_engine(engine)
+    app.add_middleware(metrics.MetricsMiddleware, server_timing=METRICS_SERVER_TIMING)
+
+if replica_router.enabled:
+    app.add_middleware(ReplicaPinMiddleware)
+
+if PROFILING_ENABLED:
+    for profiled_engine in (engine, *replica_engines):
+        profiling.instrument_engine(profiled_engine)
+    # Outermost, so the profile covers the other middleware too
+    app.add_middleware(
+        profiling.ProfilingMiddleware,
+        store=profiling.profile_store,
+        sampler=profiling.sampler,
+        sample_rate=PROFILE_SAMPLE_RATE,
+        max_queries=PROFILE_MAX_QUERIES
+    )
+
 # Auth
 
 @app.post("/api/v1/register/", response_model=ItemId, tags=["auth"])
-async def register_user(user_data: CreateUser, session: SessionDependency):
+async def register_user(
+    user_data: CreateUser, admitted: AdmissionDependency, session: SessionDependency
+):
     user = User(**user_data.model_dump())
-    user.password = auth.hash_password(user.password)
+    user.password = await auth.hash_password(user.password)
     await add_item(session, user)
     return {"id": user.id}
 
 @app.post("/api/v1/admin_register/", response_model=ItemId, tags=["auth"])
-async def admin_register(user_data: CreateUser, session: SessionDependency):
+async def admin_register(
+    user_data: CreateUser, admitted: AdmissionDependency, session: SessionDependency
+):
     user = User(**user_data.model_dump(), role=UserRole.admin)
-    user.password = auth.hash_password(user.password)
+    user.password = await auth.hash_password(user.password)
     await add_item(session, user)
     return {"id": user.id}
 
 @app.post("/api/v1/login/", response_model=str, tags=["auth"])
-async def login_user(user_data: BaseUser, session: SessionDependency):
+async def login_user(
+    user_data: BaseUser, admitted: AdmissionDependency, session: SessionDependency
+):
     user_query = select(User).where(User.email == user_data.email)
     user_model = await session.scalar(user_query)
     if user_model is None:
         raise fastapi.HTTPException(status_code=401, detail="User not found")
-    if not auth.check_password(user_data.password, user_model.password):
+    # Hand the connection back to the pool while bcrypt runs, a rehash write
+    # checks one out again
+    await session.commit()
+    if not await auth.check_password(user_data.password, user_model.password):
         raise fastapi.HTTPException(status_code=401, detail="Incorrect password")
+    if auth.password_hasher.needs_rehash(user_model.password):
+        user_model.password = await auth.hash_password(user_data.password)
     user_data = {
         "id": user_model.id,
         "role": user_model.role}
     return auth.create_token(user_data)
 
+@app.post("/api/v1/logout/", response_model=StatusResponse, tags=["auth"])
+async def logout_user(user_info: TokenDependency, token: str = Depends(auth.oauth2_scheme)):
+    await auth.revoke_token(token)
+    return {"status": "ok"}
+
 @app.get("/api/v1/my_profile/", response_model=GetUserDetails, tags=["auth"])
-async def get_user(user_info: TokenDependency, session: SessionDependency):
+async def get_user(
+    user_info: TokenDependency, session: ReadSessionDependency, user_fields: UserFieldsDependency
+):
     user_id = user_info.get("id")
-    user = await get_item(session, User, user_id)
-    return user
+    if user_fields is None:
+        user = await get_item(session, User, user_id, USER_BOOKS)
+        return json_response(user, user_details_record)
+    user = await get_item(session, User, user_id, load_options(user_fields))
+    return json_response(user, fieldset_record(user_fields))
 
 @app.patch("/api/v1/my_profile/", response_model=GetUser, tags=["auth"])
 async def update_user(user_info: TokenDependency, user_data: UpdateUser, session: SessionDependency):
     user_id = user_info.get("id")
     user = await get_item(session, User, user_id)
+    password_changed = False
     for field, value in user_data.model_dump(exclude_unset=True).items():
         if field == "password":
-            value = auth.hash_password(value)
+            value = await auth.hash_password(value)
+            password_changed = True
         setattr(user, field, value)
     user = await add_item(session, user)
+    if password_changed:
+        on_commit(session, auth.revoke_user_tokens, user_id)
     return user
 
 @app.delete("/api/v1/my_profile/", response_model=StatusResponse, tags=["auth"])
 async def delete_user(user_info: TokenDependency, session: SessionDependency):
     user_id = user_info.get("id")
     user = await get_item(session, User, user_id)
-    if user.books:
+    if await session.scalar(select(exists().where(book_user.c.user_id == user_id))):
         raise HTTPException(
             status_code=400,
             detail="Cannot delete user with books, you should return books first"
         )
     await session.delete(user)
-    await session.commit()
+    await session.flush()
+    on_commit(session, auth.revoke_user_tokens, user_id)
     return {"status": "deleted"}
 
 # Users
 
-@app.get("/api/v1/users/", response_model=list[GetUser], tags=["users"])
-async def get_users(session: SessionDependency, user: UserAdminDependency):
-    query = select(User)
-    result = await session.execute(query)
-    users = result.unique().scalars().all()
-    return users
+@app.get("/api/v1/users/", response_model=Page[GetUser], tags=["users"])
+async def get_users(
+    session: ReadSessionDependency, pagination: PaginationDependency, user: UserAdminDependency
+):
+    page = await paginate(session, select(User), pagination)
+    return json_response(page, page_encoder(user_record))
 
 @app.get("/api/v1/users/{user_id}", response_model=GetUserDetails, tags=["users"])
-async def get_user(user_id: int, session: SessionDependency, user: UserAdminDependency):
-    user = await get_item(session, User, user_id)
-    return user
+async def get_user(
+    user_id: int,
+    session: ReadSessionDependency,
+    user: UserAdminDependency,
+    user_fields: UserFieldsDependency
+):
+    if user_fields is None:
+        user = await get_item(session, User, user_id, USER_BOOKS)
+        return json_response(user, user_details_record)
+    user = await get_item(session, User, user_id, load_options(user_fields))
+    return json_response(user, fieldset_record(user_fields))
 
 # Authors
 
-@app.get("/api/v1/authors/", response_model=list[AuthorSchema], tags=["authors"])
-async def get_authors(session: SessionDependency):
-    query = select(Author)
-    result = await session.execute(query)
-    authors = result.scalars().all()
-    return authors
+@app.get("/api/v1/authors/", response_model=Page[AuthorSchema], tags=["authors"])
+async def get_authors(
+    request: Request, session: ReadSessionDependency, pagination: PaginationDependency
+):
+    async def load():
+        return await paginate(session, select(Author), pagination), ["authors"]
+    key = request_key("authors", request)
+    return await response_cache.respond(request, key, page_encoder(author_record), load)
 
 @app.get("/api/v1/authors/{author_id}", response_model=AuthorSchema, tags=["authors"])
-async def get_author(author_id: int, session: SessionDependency):
-    author = await get_item(session, Author, author_id)
-    return author.dict
+async def get_author(author_id: int, request: Request, session: ReadSessionDependency):
+    async def load():
+        author = await get_item(session, Author, author_id)
+        return author, [f"author:{author_id}"]
+    return await response_cache.respond(request, f"author:{author_id}", author_record, load)
 
 @app.post("/api/v1/authors/", response_model=AuthorSchema, tags=["authors"])
 async def create_author(
@@ -116,7 +210,9 @@ async def create_author(
 ):
     author = Author(**author.model_dump())
     await add_item(session, author)
-    return author
+    on_commit(session, response_cache.invalidate, "authors")
+    on_commit(session, suggest_index.author_changed, author.id, author.name)
+    return json_response(author, author_record)
 
 @app.patch("/api/v1/authors/{author_id}", response_model=StatusResponse, tags=["authors"])
 async def update_author(
@@ -129,6 +225,8 @@ async def update_author(
     for field, value in author.model_dump(exclude_unset=True).items():
         setattr(db_author, field, value)
     author = await add_item(session, db_author)
+    on_commit(session, response_cache.invalidate, "authors", f"author:{author_id}")
+    on_commit(session, suggest_index.author_changed, author_id, author.name)
     return {"status": "ok"}
 
 @app.delete("/api/v1/authors/{author_id}", response_model=StatusResponse, tags=["authors"])
@@ -137,63 +235,150 @@ async def delete_author(
 ):
     author = await get_item(session, Author, author_id)
     await session.delete(author)
-    await session.commit()
+    await session.flush()
+    on_commit(session, response_cache.invalidate, "authors", f"author:{author_id}")
+    on_commit(session, suggest_index.author_deleted, author_id)
     return {"status": "deleted"}
 
 # Genres
 
-@app.get("/api/v1/genres/", response_model=list[GenreSchema], tags=["genres"])
-async def get_genres(session: SessionDependency):
-    query = select(Genre)
-    result = await session.execute(query)
-    genres = result.scalars().all()
-    return genres
+@app.get("/api/v1/genres/", response_model=Page[GenreSchema], tags=["genres"])
+async def get_genres(
+    request: Request, session: ReadSessionDependency, pagination: PaginationDependency
+):
+    async def load():
+        return await paginate(session, select(Genre), pagination), ["genres"]
+    key = request_key("genres", request)
+    return await response_cache.respond(request, key, page_encoder(name_record), load)
+
+async def add_genre(session: Session, genre: GenreSchema) -> Genre:
+    genre = Genre(**genre.model_dump())
+    await add_item(session, genre)
+    on_commit(session, response_cache.invalidate, "genres")
+    return genre
 
 @app.post("/api/v1/genres/", response_model=GenreSchema, tags=["genres"])
 async def create_genre(
     genre: GenreSchema, session: SessionDependency, user: UserAdminDependency
 ):
-    genre = Genre(**genre.model_dump())
-    await add_item(session, genre)
-    return genre
+    return json_response(await add_genre(session, genre), name_record)
 
 # Books
 
-@app.get("/api/v1/books/", response_model=list[GetBook], tags=["books"])
-async def get_books(query: FiltersDependency, session: SessionDependency):
-    return query
+@app.get("/api/v1/books/", response_model=Page[GetBook], tags=["books"])
+async def get_books(
+    query: FiltersDependency, session: ReadSessionDependency, book_fields: BookFieldsDependency
+):
+    # The query itself was narrowed to the same fields by get_filters
+    encode = book_record if book_fields is None else fieldset_record(book_fields)
+    return json_response(query, page_encoder(encode))
+
+@app.get("/api/v1/books/suggest", response_model=Suggestions, tags=["books"])
+async def suggest_books(
+    q: str = Query(min_length=1, description="Начало слова из названия книги или имени автора"),
+    limit: int = Query(default=10, ge=1, le=MAX_PAGE_SIZE, description="Количество подсказок")
+):
+    # Served from the in-memory index, no database round trip per keystroke
+    return json_response(suggest_index.suggest(q, limit), suggestions_record)
+
+@app.get(
+    "/api/v1/books/export/",
+    response_class=StreamingResponse,
+    tags=["books"],
+    responses={200: {"content": {
+        "application/x-ndjson": {"schema": {"type": "string"}},
+        "text/csv": {"schema": {"type": "string"}}
+    }}}
+)
+async def export_books(
+    request: Request,
+    book_query: BookQueryDependency,
+    user: UserAdminDependency,
+    format: Literal["ndjson", "csv"] = Query(default="ndjson", description="Формат выгрузки")
+):
+    return StreamingResponse(
+        stream_books(request, book_query, format, EXPORT_BATCH_SIZE),
+        media_type=MEDIA_TYPES[format],
+        headers={"Content-Disposition": f'attachment; filename="books.{format}"'}
+    )
 
 @app.get("/api/v1/books/{book_id}", response_model=GetBook, tags=["books"])
-async def get_book(book_id: int, session: SessionDependency):
-    book = await get_item(session, Book, book_id)
-    return book.dict
+async def get_book(
+    book_id: int, request: Request, session: ReadSessionDependency, book_fields: BookFieldsDependency
+):
+    key, options, encode, relations = f"book:{book_id}", BOOK_RELATIONS, book_record, {"authors", "genres"}
+    if book_fields is not None:
+        key = f"{key}?fields={book_fields.key}"
+        options, encode = load_options(book_fields), fieldset_record(book_fields)
+        relations = book_fields.nested.keys()
+
+    async def load():
+        book = await get_item(session, Book, book_id, options)
+        tags = [f"book:{book_id}"]
+        if "authors" in relations:
+            tags += [f"author:{author.id}" for author in book.authors]
+        if "genres" in relations:
+            tags += [f"genre:{genre.id}" for genre in book.genres]
+        return book, tags
+    return await response_cache.respond(request, key, encode, load)
+
+@app.get("/api/v1/books/{book_id}/similar", response_model=list[SimilarBook], tags=["books"])
+async def get_similar_books(
+    book_id: int,
+    session: ReadSessionDependency,
+    limit: int = Query(default=10, ge=1, le=MAX_PAGE_SIZE, description="Количество книг")
+):
+    # Ranking comes from the in-memory model, the database only supplies titles by id
+    similar = similar_books.similar(book_id, limit)
+    ids = [book_id] + [other for other, _, _ in similar]
+    titles = dict((await session.execute(
+        select(Book.id, Book.title).where(Book.id.in_(ids))
+    )).all())
+    if book_id not in titles:
+        raise HTTPException(status_code=404, detail="Book not found")
+    return [
+        {"id": other, "title": titles[other], "score": score, "source": source}
+        for other, score, source in similar if other in titles
+    ]
 
 @app.post("/api/v1/books/", response_model=GetBook, tags=["books"])
 async def create_book(
     book: AddBook, session: SessionDependency, user: UserAdminDependency
 ):
-    authors = []
-    for author_id in book.authors:
-        author = await get_item(session, Author, author_id)
-        if author is None:
-            raise HTTPException(status_code=404, detail=f"Author {author_id} not found")
-        authors.append(author)
-    genres = []
-    for genre_id in book.genres:
-        genre = await get_item(session, Genre, genre_id)
-        if genre is None:
-            raise HTTPException(status_code=404, detail=f"Genre {genre_id} not found")
-        genres.append(genre)
-    book = Book(
-        title=book.title,
-        description=book.description,
-        release_year=book.release_year,
-        authors=authors,
-        genres=genres,
-        available_stock=book.available_stock
-    )
+    authors = await get_items(session, Author, book.authors)
+    genres = await get_items(session, Genre, book.genres)
+    book = Book(**book_values(book), authors=authors, genres=genres)
     await add_item(session, book)
-    return book.dict
+    await stats.book_created(session, book)
+    on_commit(session, suggest_index.book_changed, book.id, book.title)
+    return json_response(book, book_record)
+
+@app.post(
+    "/api/v1/books/import/",
+    response_model=ImportReport,
+    tags=["books"],
+    openapi_extra={"requestBody": {"required": True, "content": {
+        "application/x-ndjson": {"schema": {"type": "string"}},
+        "text/csv": {"schema": {"type": "string"}}
+    }}}
+)
+async def import_books(
+    request: Request,
+    session: SessionDependency,
+    user: UserAdminDependency,
+    format: Optional[Literal["ndjson", "csv"]] = Query(
+        default=None, description="Формат данных, по умолчанию из Content-Type"
+    )
+):
+    if format is None:
+        content_type = request.headers.get("content-type", "")
+        format = "csv" if content_type.startswith("text/csv") else "ndjson"
+    parse = iter_csv if format == "csv" else iter_ndjson
+    importer = BookImporter(session, IMPORT_BATCH_SIZE)
+    async for line, record in parse(iter_lines(request.stream())):
+        await importer.add(line, record)
+    await importer.flush()
+    return importer.report
 
 @app.patch("/api/v1/books/{book_id}", response_model=StatusResponse, tags=["books"])
 async def update_book(
@@ -201,17 +386,43 @@ async def update_book(
     book: UpdateBook,
     session: SessionDependency
 ):
-    db_book = await get_item(session, Book, book_id)
-    for field, value in book.model_dump(exclude_unset=True).items():
+    data = book.model_dump(exclude_unset=True)
+    relations = {"authors": Author, "genres": Genre}
+    options = [
+        selectinload(getattr(Book, field)) for field in relations
+        if data.get(field) is not None
+    ]
+    # Rentals change available_stock concurrently: the statistics get the difference
+    # to the stock as it is when the new value is written, so the row is locked first
+    db_book = await get_item(
+        session, Book, book_id, options, for_update="available_stock" in data
+    )
+    changes = {"available_stock": -db_book.available_stock}
+    for field, value in data.items():
+        if field in relations:
+            if value is None:
+                continue
+            value = await get_items(session, relations[field], value)
+            changes[field] = stats.link_changes(
+                [item.id for item in getattr(db_book, field)], [item.id for item in value]
+            )
         setattr(db_book, field, value)
     book = await add_item(session, db_book)
+    changes["available_stock"] += db_book.available_stock
+    await stats.adjust_books(session, **changes)
+    on_commit(session, response_cache.invalidate, f"book:{book_id}")
+    if "title" in data:
+        on_commit(session, suggest_index.book_changed, book_id, db_book.title)
     return {"status": "ok"}
 
 @app.delete("/api/v1/books/{book_id}", response_model=StatusResponse, tags=["books"])
 async def delete_book(book_id: int, session: SessionDependency):
-    book = await get_item(session, Book, book_id)
+    book = await get_item(session, Book, book_id, for_update=True)
+    await stats.book_deleted(session, book_id, book.available_stock)
     await session.delete(book)
-    await session.commit()
+    await session.flush()
+    on_commit(session, response_cache.invalidate, f"book:{book_id}")
+    on_commit(session, suggest_index.book_deleted, book_id)
     return {"status": "deleted"}
 
 # Actions with books
@@ -220,26 +431,181 @@ async def delete_book(book_id: int, session: SessionDependency):
 async def rent_book(
     book_id: int, user_id: int, session: SessionDependency, user: UserAdminDependency
 ):
-    book = await get_item(session, Book, book_id)
-    user = await get_item(session, User, user_id)
-    if book.available_stock == 0:
+    try:
+        rented = await rentals.rent_book(session, book_id, user_id)
+    except IntegrityError:
+        raise HTTPException(status_code=409, detail="Book is being rented concurrently")
+    if not rented:
+        state = await rentals.rental_state(session, book_id, user_id)
+        failure = rentals.rent_failure(state)
+        if failure is not None:
+            status_code, detail = failure
+            raise HTTPException(status_code=status_code, detail=detail)
         return {"status": "book not available"}
-    if len(user.books) == 5:
-        raise HTTPException(status_code=400, detail=f"User {user.name} has already 5 books")
-    book.available_stock -= 1
-    user.books.append(book)
-    await session.commit()
+    on_commit(session, response_cache.invalidate, f"book:{book_id}")
     return {"status": "ok"}
 
 @app.delete("/api/v1/books/{book_id}/users/{user_id}", response_model=StatusResponse, tags=["rent actions"])
 async def return_book(
     book_id: int, user_id: int, session: SessionDependency, user: UserAdminDependency
 ):
-    book = await get_item(session, Book, book_id)
-    user = await get_item(session, User, user_id)
-    if book not in user.books:
-        raise HTTPException(status_code=404, detail=f"Book {book.title} not found in user's books")
-    book.available_stock += 1
-    user.books.remove(book)
-    await session.commit()
+    if not await rentals.return_book(session, book_id, user_id):
+        state = await rentals.rental_state(session, book_id, user_id)
+        status_code, detail = rentals.return_failure(state)
+        raise HTTPException(status_code=status_code, detail=detail)
+    on_commit(session, response_cache.invalidate, f"book:{book_id}")
     return {"status": "ok"}
+
+@app.post("/api/v1/rentals/batch/", response_model=list[RentalResult], tags=["rent actions"])
+async def rent_batch(
+    actions: list[RentalAction], session: SessionDependency, user: UserAdminDependency
+):
+    results = []
+    try:
+        for item in actions:
+            result = item.model_dump()
+            if item.action == "rent":
+                applied = await rentals.rent_book(session, item.book_id, item.user_id)
+            else:
+                applied = await rentals.return_book(session, item.book_id, item.user_id)
+            if applied:
+                result["status"] = "ok"
+            else:
+                state = await rentals.rental_state(session, item.book_id, item.user_id)
+                if item.action == "rent":
+                    failure = rentals.rent_failure(state)
+                else:
+                    failure = rentals.return_failure(state)
+                if failure is None:
+                    result["status"] = "book not available"
+                else:
+                    result["status"] = "error"
+                    result["detail"] = failure[1]
+            results.append(result)
+    except IntegrityError:
+        raise HTTPException(status_code=409, detail="Books are being rented concurrently")
+    on_commit(session, response_cache.invalidate, *{
+        f"book:{result['book_id']}" for result in results if result["status"] == "ok"
+    })
+    return results
+
+@app.get("/api/v1/rentals/overdue/", response_model=Page[OverdueLoan], tags=["rent actions"])
+async def get_overdue_rentals(
+    session: ReadSessionDependency, pagination: PaginationDependency, user: UserAdminDependency
+):
+    query = overdue_query(datetime.datetime.now())
+    page = await paginate(session, query, pagination, OVERDUE_KEYS, entities=False)
+    return json_response(page, page_encoder(overdue_record))
+
+# Batch
+
+BATCH_OPERATIONS = {
+    "create_author": BatchOp(create_author, body=("author", CreateAuthor)),
+    "update_author": BatchOp(update_author, ("author_id",), ("author", UpdateAuthor)),
+    "delete_author": BatchOp(delete_author, ("author_id",)),
+    # GenreSchema has no id, batch references need one
+    "create_genre": BatchOp(
+        add_genre, body=("genre", GenreSchema),
+        output=lambda genre: {"id": genre.id, **name_record(genre)}
+    ),
+    "create_book": BatchOp(create_book, body=("book", AddBook)),
+    "update_book": BatchOp(update_book, ("book_id",), ("book", UpdateBook)),
+    "delete_book": BatchOp(delete_book, ("book_id",)),
+    "rent_book": BatchOp(rent_book, ("book_id", "user_id")),
+    "return_book": BatchOp(return_book, ("book_id", "user_id")),
+}
+
+@app.post("/api/v1/batch", response_model=list[BatchResult], tags=["batch"])
+async def run_batch(batch: BatchRequest, session: SessionDependency, user: UserAdminDependency):
+    # One token check, one session and one commit for the whole list
+    if len(batch.operations) > MAX_BATCH_OPERATIONS:
+        raise HTTPException(
+            status_code=400, detail=f"At most {MAX_BATCH_OPERATIONS} operations per batch"
+        )
+    return await BatchRunner(BATCH_OPERATIONS, session, user).run(batch)
+
+# Service
+
+@app.get("/api/v1/health/", response_model=HealthStatus, tags=["service"])
+async def get_health():
+    # No database round trip while healthy, the schema state comes from the startup
+    # check; a degraded state is re-checked, at most every SCHEMA_RECHECK_INTERVAL
+    await schema_state.refresh(engine)
+    return schema_state.report()
+
+@app.get("/api/v1/cache/stats/", response_model=CacheStats, tags=["service"])
+async def get_cache_stats(user: UserAdminDependency):
+    return await response_cache.stats()
+
+@app.get("/api/v1/suggest/stats/", response_model=SuggestStats, tags=["service"])
+async def get_suggest_stats(user: UserAdminDependency):
+    return suggest_index.stats()
+
+@app.get("/api/v1/similar/stats/", response_model=SimilarStats, tags=["service"])
+async def get_similar_stats(user: UserAdminDependency):
+    return similar_books.stats()
+
+@app.get("/api/v1/pool/stats/", response_model=PoolStats, tags=["service"])
+async def get_pool_stats(user: UserAdminDependency):
+    checkouts = pool_stats.checkouts
+    return {
+        **pool_status(engine),
+        "checkouts": checkouts,
+        "total_wait": pool_stats.total_wait,
+        "avg_wait": pool_stats.total_wait / checkouts if checkouts else 0.0,
+        "max_wait": pool_stats.max_wait
+    }
+
+@app.get("/api/v1/profiles/", response_model=list[ProfileSummary], tags=["service"])
+async def get_profiles(user: UserAdminDependency):
+    return [profile.summary() for profile in await profiling.profile_store.recent()]
+
+@app.get("/api/v1/profiles/{profile_id}", response_model=ProfileReport, tags=["service"])
+async def get_profile(profile_id: str, user: UserAdminDependency):
+    profile = await profiling.profile_store.get(profile_id)
+    if profile is None:
+        raise HTTPException(status_code=404, detail="Profile not found")
+    return profile.report()
+
+@app.get("/api/v1/profiles/{profile_id}/folded", response_class=PlainTextResponse, tags=["service"])
+async def get_profile_stacks(profile_id: str, user: UserAdminDependency):
+    # Collapsed stack format: flamegraph.pl, speedscope or inferno render it as is
+    profile = await profiling.profile_store.get(profile_id)
+    if profile is None:
+        raise HTTPException(status_code=404, detail="Profile not found")
+    return PlainTextResponse(profile.folded())
+
+# Statistics
+
+@app.get("/api/v1/stats/", response_model=CatalogStats, tags=["stats"])
+async def get_catalog_stats(session: ReadSessionDependency, user: UserAdminDependency):
+    return await stats.catalog_totals(session)
+
+@app.get("/api/v1/stats/genres/", response_model=Page[GenreCount], tags=["stats"])
+async def get_genre_stats(
+    session: ReadSessionDependency, pagination: PaginationDependency, user: UserAdminDependency
+):
+    page = await stats.genre_counts(session, pagination)
+    return json_response(page, page_encoder(genre_count_record))
+
+@app.get("/api/v1/stats/authors/", response_model=Page[AuthorCount], tags=["stats"])
+async def get_author_stats(
+    session: ReadSessionDependency, pagination: PaginationDependency, user: UserAdminDependency
+):
+    page = await stats.author_counts(session, pagination)
+    return json_response(page, page_encoder(author_count_record))
+
+@app.get("/api/v1/stats/most-rented/", response_model=list[BookRentals], tags=["stats"])
+async def get_most_rented(
+    session: ReadSessionDependency,
+    user: UserAdminDependency,
+    limit: int = Query(default=10, ge=1, le=MAX_PAGE_SIZE, description="Количество книг")
+):
+    counters = await stats.most_rented(session, limit)
+    return json_response(counters, lambda items: [book_rentals_record(item) for item in items])
+
+@app.get("/metrics", response_class=PlainTextResponse, include_in_schema=False)
+async def get_metrics():
+    return PlainTextResponse(
+        metrics.registry.render(), media_type="text/plain; version=0.0.4"
+    )
@@ -1,45 +1,55 @@
-import os
-from datetime import timedelta, datetime
+import time
 
-import bcrypt
 import jwt
 from fastapi.security import OAuth2PasswordBearer
 from fastapi import Depends, HTTPException, status
 
-from config import SECRET_KEY, ALGORITHM, ACCESS_TOKEN_EXPIRE_MINUTES
+from config import (
+    SECRET_KEY, ALGORITHM, ACCESS_TOKEN_EXPIRE_MINUTES, BCRYPT_ROUNDS, HASH_WORKERS, HASH_POOL,
+    TOKEN_CACHE_SIZE, REVOCATION_BACKEND
+)
+from hashing import PasswordHasher
+from plugins import load_backend
+from throttle import hashing_limit
+from tokens import InMemoryRevocationBackend, RevocationBackend, TokenCache, token_key
 
 
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="token")
+password_hasher = PasswordHasher(HASH_WORKERS, BCRYPT_ROUNDS, HASH_POOL)
+token_cache = TokenCache(TOKEN_CACHE_SIZE)
+revocation_backend = load_backend(REVOCATION_BACKEND, InMemoryRevocationBackend)
 
-def hash_password(password: str) -> str:
-    password = password.encode()
-    password = bcrypt.hashpw(password, bcrypt.gensalt())
-    password = password.decode()
-    return password
+def set_revocation_backend(backend: RevocationBackend):
+    global revocation_backend
+    revocation_backend = backend
 
-def check_password(password: str, hashed_password: str) -> bool:
-    password = password.encode()
-    hashed_password = hashed_password.encode()
-    return bcrypt.checkpw(password, hashed_password)
+async def hash_password(password: str) -> str:
+    async with hashing_limit.slot():
+        return await password_hasher.hash(password)
+
+async def check_password(password: str, hashed_password: str) -> bool:
+    async with hashing_limit.slot():
+        return await password_hasher.verify(password, hashed_password)
 
 def create_token(user_data: dict) -> str:
+    issued_at = time.time()
     payload = {
         "user": user_data,
-        "exp": datetime.now() + timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
+        "iat": issued_at,
+        "exp": issued_at + ACCESS_TOKEN_EXPIRE_MINUTES * 60
     }
     token = jwt.encode(payload, SECRET_KEY, algorithm=ALGORITHM)
     return token
 
-def get_current_user(token: str = Depends(oauth2_scheme)):
+def decode_token(token: str) -> dict:
         try:
             payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-            user_data = payload.get("user")
-            if user_data is None:
+            if payload.get("user") is None:
                 raise HTTPException(
                     status_code=status.HTTP_401_UNAUTHORIZED,
                     detail="Could not validate credentials",
                 )
-            return user_data
+            return payload
         except jwt.ExpiredSignatureError:
             raise HTTPException(
                 status_code=status.HTTP_401_UNAUTHORIZED,
@@ -50,3 +60,33 @@ def get_current_user(token: str = Depends(oauth2_scheme)):
                 status_code=status.HTTP_401_UNAUTHORIZED,
                 detail="Invalid token",
             )
+
+def verified_payload(token: str, key: str) -> dict:
+    payload = token_cache.get(key)
+    if payload is None:
+        payload = decode_token(token)
+        token_cache.set(key, payload, payload["exp"])
+    return payload
+
+async def get_current_user(token: str = Depends(oauth2_scheme)):
+    key = token_key(token)
+    payload = verified_payload(token, key)
+    user_data = payload["user"]
+    if await revocation_backend.is_revoked(key, user_data.get("id"), payload.get("iat", 0)):
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Token revoked",
+        )
+    return user_data
+
+async def revoke_token(token: str):
+    key = token_key(token)
+    payload = verified_payload(token, key)
+    token_cache.discard(key)
+    await revocation_backend.revoke_token(key, payload["exp"])
+
+async def revoke_user_tokens(user_id: int):
+    now = time.time()
+    await revocation_backend.revoke_user_tokens(
+        user_id, now, now + ACCESS_TOKEN_EXPIRE_MINUTES * 60
+    )
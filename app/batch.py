@@ -0,0 +1,154 @@
+import inspect
+from dataclasses import dataclass, field
+from typing import Any, Awaitable, Callable
+
+import orjson
+from fastapi import HTTPException, Response
+from pydantic import BaseModel, ValidationError
+from sqlalchemy.exc import IntegrityError
+
+from models import Session
+from schema import BatchOperation, BatchRequest
+
+
+@dataclass
+class BatchOp:
+    # How a batch operation maps onto an API handler: path parameters by name, the
+    # request body as (argument name, schema). The session and the batch's admin are
+    # passed in as the handler's own dependencies would have been. output turns the
+    # handler's return value into the result body when it is not a response or dict.
+    handler: Callable[..., Awaitable]
+    params: tuple[str, ...] = ()
+    body: tuple[str, type[BaseModel]] | None = None
+    output: Callable[[Any], Any] | None = None
+    takes_user: bool = field(init=False)
+
+    def __post_init__(self):
+        self.takes_user = "user" in inspect.signature(self.handler).parameters
+
+
+class OperationFailed(Exception):
+    def __init__(self, status_code: int, detail: Any):
+        self.status_code = status_code
+        self.detail = detail
+
+
+class BatchRunner:
+    # Runs the operations in order in the request's session and transaction.
+    # "atomic": the first failure rolls everything back and is returned as the error.
+    # "independent": every operation runs in a savepoint, failures are reported per
+    # operation and the rest is committed.
+    # "$name" (or "$name.field") anywhere in params or body is replaced by the id (or
+    # field) of the result of the earlier operation with that id.
+    def __init__(self, operations: dict[str, BatchOp], session: Session, user: dict):
+        self.operations = operations
+        self.session = session
+        self.user = user
+        self.names: set[str] = set()
+        self.outputs: dict[str, Any] = {}
+
+    def check(self, batch: BatchRequest):
+        names = set()
+        for index, operation in enumerate(batch.operations):
+            if operation.op not in self.operations:
+                raise HTTPException(
+                    status_code=400, detail=f"Operation {index}: unknown operation {operation.op}"
+                )
+            if operation.id is not None:
+                if operation.id in names:
+                    raise HTTPException(
+                        status_code=400, detail=f"Operation {index}: duplicate id {operation.id}"
+                    )
+                names.add(operation.id)
+
+    def resolve(self, value: Any) -> Any:
+        if isinstance(value, str) and value.startswith("$"):
+            name, _, attribute = value[1:].partition(".")
+            if name not in self.names:
+                return value
+            if name not in self.outputs:
+                raise OperationFailed(424, f"Operation {name} failed")
+            output = self.outputs[name]
+            attribute = attribute or "id"
+            if not isinstance(output, dict) or attribute not in output:
+                raise OperationFailed(400, f"Result of {name} has no field {attribute}")
+            return output[attribute]
+        if isinstance(value, list):
+            return [self.resolve(item) for item in value]
+        if isinstance(value, dict):
+            return {key: self.resolve(item) for key, item in value.items()}
+        return value
+
+    async def call(self, operation: BatchOperation) -> Any:
+        spec = self.operations[operation.op]
+        params = self.resolve(operation.params)
+        kwargs = {}
+        for name in spec.params:
+            value = params.get(name)
+            if type(value) is not int:
+                raise OperationFailed(422, f"Parameter {name} must be an integer")
+            kwargs[name] = value
+        if spec.body is not None:
+            argument, schema = spec.body
+            try:
+                kwargs[argument] = schema.model_validate(self.resolve(operation.body or {}))
+            except ValidationError as err:
+                raise OperationFailed(422, [
+                    {"loc": list(error["loc"]), "msg": error["msg"]} for error in err.errors()
+                ])
+        if spec.takes_user:
+            kwargs["user"] = self.user
+        try:
+            result = await spec.handler(session=self.session, **kwargs)
+        except HTTPException as err:
+            raise OperationFailed(err.status_code, err.detail)
+        except IntegrityError:
+            raise OperationFailed(409, "Conflicts with existing data")
+        if spec.output is not None:
+            return spec.output(result)
+        if isinstance(result, Response):
+            return orjson.loads(result.body)
+        return result
+
+    async def execute(self, operation: BatchOperation, savepoint: bool) -> Any:
+        if not savepoint:
+            output = await self.call(operation)
+        else:
+            callbacks = self.session.info.setdefault("after_commit", [])
+            registered = len(callbacks)
+            try:
+                async with self.session.begin_nested():
+                    output = await self.call(operation)
+            except OperationFailed:
+                # The savepoint is gone, so are the side effects it scheduled
+                del callbacks[registered:]
+                self.session.expunge_all()
+                raise
+        # Handlers mix ORM and Core writes; later operations load fresh objects
+        # instead of identity-map copies that a Core UPDATE has made stale
+        await self.session.flush()
+        self.session.expunge_all()
+        return output
+
+    async def run(self, batch: BatchRequest) -> list[dict]:
+        self.check(batch)
+        results = []
+        for index, operation in enumerate(batch.operations):
+            result = {"id": operation.id, "op": operation.op}
+            try:
+                output = await self.execute(operation, batch.mode == "independent")
+            except OperationFailed as err:
+                results.append({**result, "status": err.status_code, "body": {"detail": err.detail}})
+                if batch.mode == "atomic":
+                    # Raising makes the session dependency roll the transaction back
+                    raise HTTPException(
+                        status_code=err.status_code,
+                        detail={"failed": index, "results": results}
+                    )
+            else:
+                results.append({**result, "status": 200, "body": output})
+                if operation.id is not None:
+                    self.outputs[operation.id] = output
+            if operation.id is not None:
+                self.names.add(operation.id)
+        return results
@@ -0,0 +1,193 @@
+import hashlib
+import time
+from collections import OrderedDict
+from email.utils import formatdate
+from typing import Any, Awaitable, Callable, Iterable, NamedTuple
+from urllib.parse import urlencode
+
+from fastapi import Request, Response
+
+from config import (
+    REPLICA_PIN_SECONDS, RESPONSE_CACHE_BACKEND, RESPONSE_CACHE_SIZE, RESPONSE_CACHE_TTL
+)
+from plugins import load_backend
+from serialize import Encoder, dump
+
+
+class CacheEntry(NamedTuple):
+    body: bytes
+    etag: str
+    last_modified: float
+    tags: tuple[str, ...]
+
+
+class CacheBackend:
+    # A shared implementation must keep `generation` monotonic across workers:
+    # set() drops entries whose tags were invalidated after `generation`, which
+    # stops a slow reader from caching data that a concurrent write replaced, and
+    # those invalidated less than `lag` seconds ago (data read from a replica may
+    # predate a write the replica has not replayed yet)
+    async def get(self, key: str) -> CacheEntry | None:
+        raise NotImplementedError
+
+    async def set(
+        self, key: str, entry: CacheEntry, ttl: float, generation: int, lag: float = 0.0
+    ) -> bool:
+        raise NotImplementedError
+
+    async def invalidate(self, tags: Iterable[str]) -> int:
+        raise NotImplementedError
+
+    async def generation(self) -> int:
+        raise NotImplementedError
+
+    async def size(self) -> int:
+        raise NotImplementedError
+
+
+class InMemoryCacheBackend(CacheBackend):
+    # Invalidation marks only need to outlive the slowest in-flight read and the
+    # replica lag allowance
+    mark_lifetime = 60.0
+
+    def __init__(self, maxsize: int):
+        self.maxsize = maxsize
+        self._entries: OrderedDict[str, tuple[CacheEntry, float]] = OrderedDict()
+        self._tags: dict[str, set[str]] = {}
+        self._invalidated: dict[str, tuple[int, float]] = {}
+        self._generation = 0
+
+    def _remove(self, key: str):
+        entry, _ = self._entries.pop(key)
+        for tag in entry.tags:
+            keys = self._tags.get(tag)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._tags[tag]
+
+    async def get(self, key: str) -> CacheEntry | None:
+        item = self._entries.get(key)
+        if item is None:
+            return None
+        entry, expires_at = item
+        if expires_at <= time.monotonic():
+            self._remove(key)
+            return None
+        self._entries.move_to_end(key)
+        return entry
+
+    async def set(
+        self, key: str, entry: CacheEntry, ttl: float, generation: int, lag: float = 0.0
+    ) -> bool:
+        recent = time.monotonic() - lag
+        for tag in entry.tags:
+            invalidated, invalidated_at = self._invalidated.get(tag, (-1, 0))
+            if invalidated > generation or (lag and invalidated_at > recent):
+                return False
+        if key in self._entries:
+            self._remove(key)
+        self._entries[key] = (entry, time.monotonic() + ttl)
+        for tag in entry.tags:
+            self._tags.setdefault(tag, set()).add(key)
+        while len(self._entries) > self.maxsize:
+            self._remove(next(iter(self._entries)))
+        return True
+
+    async def invalidate(self, tags: Iterable[str]) -> int:
+        self._generation += 1
+        now = time.monotonic()
+        if len(self._invalidated) > self.maxsize:
+            self._invalidated = {
+                tag: mark for tag, mark in self._invalidated.items()
+                if mark[1] > now - self.mark_lifetime
+            }
+        removed = 0
+        for tag in tags:
+            self._invalidated[tag] = (self._generation, now)
+            for key in list(self._tags.get(tag, ())):
+                self._remove(key)
+                removed += 1
+        return removed
+
+    async def generation(self) -> int:
+        return self._generation
+
+    async def size(self) -> int:
+        return len(self._entries)
+
+
+def request_key(prefix: str, request: Request) -> str:
+    return f"{prefix}?{urlencode(sorted(request.query_params.multi_items()))}"
+
+def make_etag(body: bytes) -> str:
+    return f'"{hashlib.blake2b(body, digest_size=16).hexdigest()}"'
+
+def etag_matches(header: str | None, etag: str) -> bool:
+    if header is None:
+        return False
+    candidates = {value.strip().removeprefix("W/") for value in header.split(",")}
+    return "*" in candidates or etag in candidates
+
+
+class ResponseCache:
+    def __init__(self, backend: CacheBackend, ttl: float, replica_lag: float):
+        self.backend = backend
+        self.ttl = ttl
+        self.replica_lag = replica_lag
+        self.hits = 0
+        self.misses = 0
+        self.not_modified = 0
+        self.stale_skips = 0
+        self.invalidations = 0
+
+    async def respond(
+        self,
+        request: Request,
+        key: str,
+        encode: Encoder,
+        load: Callable[[], Awaitable[tuple[Any, Iterable[str]]]]
+    ) -> Response:
+        entry = await self.backend.get(key)
+        if entry is not None:
+            self.hits += 1
+        else:
+            self.misses += 1
+            generation = await self.backend.generation()
+            data, tags = await load()
+            body = dump(encode(data))
+            entry = CacheEntry(body, make_etag(body), time.time(), tuple(tags))
+            # A replica read right after an invalidation may still return the old
+            # data, it is served but not cached (see get_read_session)
+            lag = self.replica_lag if getattr(request.state, "replica_read", False) else 0.0
+            if not await self.backend.set(key, entry, self.ttl, generation, lag):
+                self.stale_skips += 1
+        headers = {
+            "ETag": entry.etag,
+            "Last-Modified": formatdate(entry.last_modified, usegmt=True),
+            "Cache-Control": "no-cache"
+        }
+        if etag_matches(request.headers.get("if-none-match"), entry.etag):
+            self.not_modified += 1
+            return Response(status_code=304, headers=headers)
+        return Response(content=entry.body, media_type="application/json", headers=headers)
+
+    async def invalidate(self, *tags: str):
+        self.invalidations += await self.backend.invalidate(tags)
+
+    async def stats(self) -> dict:
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "not_modified": self.not_modified,
+            "stale_skips": self.stale_skips,
+            "invalidations": self.invalidations,
+            "size": await self.backend.size()
+        }
+
+
+response_cache = ResponseCache(
+    load_backend(RESPONSE_CACHE_BACKEND, lambda: InMemoryCacheBackend(RESPONSE_CACHE_SIZE)),
+    RESPONSE_CACHE_TTL,
+    REPLICA_PIN_SECONDS
+)
@@ -7,8 +7,94 @@ POSTGRES_HOST = os.getenv("POSTGRES_HOST", "localhost")
 POSTGRES_PORT = os.getenv("POSTGRES_PORT", "5432")
 POSTGRES_DB = os.getenv("POSTGRES_DB", "test-base")
 
-DSN = f"postgresql+asyncpg://{POSTGRES_USER}:{POSTGRES_PASSWORD}@{POSTGRES_HOST}:{POSTGRES_PORT}/{POSTGRES_DB}"
+DSN = os.getenv(
+    "DATABASE_URL",
+    f"postgresql+asyncpg://{POSTGRES_USER}:{POSTGRES_PASSWORD}@{POSTGRES_HOST}:{POSTGRES_PORT}/{POSTGRES_DB}"
+)
+
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "10"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "10"))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "30"))
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "1800"))
+DB_POOL_PRE_PING = os.getenv("DB_POOL_PRE_PING", "true").lower() in ("1", "true", "yes")
+DB_STATEMENT_CACHE_SIZE = int(os.getenv("DB_STATEMENT_CACHE_SIZE", "100"))
+# Database work at startup: "check" compares the schema version (one query), "lazy" does
+# that in the background so the app is ready without touching the database, "migrate"
+# applies pending migrations first (development, single instance). A schema that is
+# behind or unreachable starts the app degraded, see /api/v1/health/
+DB_STARTUP = os.getenv("DB_STARTUP", "check")
+# While degraded, /api/v1/health/ re-checks the schema version at most this often (seconds)
+SCHEMA_RECHECK_INTERVAL = float(os.getenv("SCHEMA_RECHECK_INTERVAL", "10"))
+
+# Comma separated read replica DSNs, read-only routes use them when set
+REPLICA_DSNS = [dsn.strip() for dsn in os.getenv("REPLICA_DATABASE_URLS", "").split(",") if dsn.strip()]
+# Seconds a client reads from the primary after its own write (read-your-writes)
+REPLICA_PIN_SECONDS = float(os.getenv("REPLICA_PIN_SECONDS", "5"))
+REPLICA_HEALTH_INTERVAL = float(os.getenv("REPLICA_HEALTH_INTERVAL", "5"))
+
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "true").lower() in ("1", "true", "yes")
+METRICS_SERVER_TIMING = os.getenv("METRICS_SERVER_TIMING", "false").lower() in ("1", "true", "yes")
+# On-demand request profiling for admins (X-Profile: 1 or ?profile=1)
+PROFILING_ENABLED = os.getenv("PROFILING_ENABLED", "true").lower() in ("1", "true", "yes")
+# Fraction of all requests profiled without being asked, 0 disables
+PROFILE_SAMPLE_RATE = float(os.getenv("PROFILE_SAMPLE_RATE", "0"))
+# Seconds between stack samples of a profiled request
+PROFILE_INTERVAL = float(os.getenv("PROFILE_INTERVAL", "0.002"))
+PROFILE_MAX_QUERIES = int(os.getenv("PROFILE_MAX_QUERIES", "1000"))
+PROFILE_STORE_SIZE = int(os.getenv("PROFILE_STORE_SIZE", "100"))
+# "module:Class" of a ProfileStore, the last PROFILE_STORE_SIZE profiles in memory when unset
+PROFILE_STORE = os.getenv("PROFILE_STORE")
 
 SECRET_KEY = os.getenv("SECRET_KEY")
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 30
+TOKEN_CACHE_SIZE = int(os.getenv("TOKEN_CACHE_SIZE", "10000"))
+# "module:Class" of a shared RevocationBackend, in-memory when unset;
+# "revocation:DatabaseRevocationBackend" keeps the list in the database
+REVOCATION_BACKEND = os.getenv("REVOCATION_BACKEND")
+# Seconds between reads of other workers' revocations by DatabaseRevocationBackend
+REVOCATION_SYNC_INTERVAL = float(os.getenv("REVOCATION_SYNC_INTERVAL", "1"))
+
+BCRYPT_ROUNDS = int(os.getenv("BCRYPT_ROUNDS", "12"))
+HASH_WORKERS = int(os.getenv("HASH_WORKERS", os.cpu_count() or 1))
+HASH_POOL = os.getenv("HASH_POOL", "thread")
+# Hash/verify calls in flight per process before auth requests get 429, 0 disables
+HASH_CONCURRENCY = int(os.getenv("HASH_CONCURRENCY", HASH_WORKERS * 4))
+
+# Token buckets for login/registration: refill rate per second and burst size, rate 0 disables.
+# The IP is the client address uvicorn reports: behind a load balancer set FORWARDED_ALLOW_IPS
+# to the balancer's addresses so X-Forwarded-For is used, or every client shares one bucket
+AUTH_IP_RATE = float(os.getenv("AUTH_IP_RATE", "1"))
+AUTH_IP_BURST = int(os.getenv("AUTH_IP_BURST", "20"))
+AUTH_EMAIL_RATE = float(os.getenv("AUTH_EMAIL_RATE", "0.1"))
+AUTH_EMAIL_BURST = int(os.getenv("AUTH_EMAIL_BURST", "5"))
+# "module:Class" of a shared RateLimitBackend, per-process buckets when unset
+RATE_LIMIT_BACKEND = os.getenv("RATE_LIMIT_BACKEND")
+
+RENT_PERIOD_DAYS = int(os.getenv("RENT_PERIOD_DAYS", "7"))
+MAX_RENTED_BOOKS = 5
+STATS_SLOTS = int(os.getenv("STATS_SLOTS", "8"))
+# Seconds between overdue scans, 0 disables the scanner
+OVERDUE_SCAN_INTERVAL = float(os.getenv("OVERDUE_SCAN_INTERVAL", "300"))
+OVERDUE_SCAN_BATCH_SIZE = int(os.getenv("OVERDUE_SCAN_BATCH_SIZE", "500"))
+# "module:Class" of an OverdueSink, log messages when unset
+OVERDUE_SINK = os.getenv("OVERDUE_SINK")
+# Seconds between full rebuilds of the similar-books model, 0 builds it once at startup
+SIMILAR_REFRESH_INTERVAL = float(os.getenv("SIMILAR_REFRESH_INTERVAL", "600"))
+# Entries read per genre/author list by the catalog-overlap fallback
+SIMILAR_FALLBACK_SCAN = int(os.getenv("SIMILAR_FALLBACK_SCAN", "2000"))
+# Seconds between reloads of the title/author suggest index, 0 loads it once at startup
+SUGGEST_REFRESH_INTERVAL = float(os.getenv("SUGGEST_REFRESH_INTERVAL", "300"))
+# Characters kept per index key, longer prefixes match on their first SUGGEST_KEY_LENGTH
+SUGGEST_KEY_LENGTH = int(os.getenv("SUGGEST_KEY_LENGTH", "48"))
+
+RESPONSE_CACHE_SIZE = int(os.getenv("RESPONSE_CACHE_SIZE", "10000"))
+RESPONSE_CACHE_TTL = float(os.getenv("RESPONSE_CACHE_TTL", "60"))
+# "module:Class" of a shared CacheBackend, in-process LRU when unset
+RESPONSE_CACHE_BACKEND = os.getenv("RESPONSE_CACHE_BACKEND")
+
+DEFAULT_PAGE_SIZE = 20
+MAX_PAGE_SIZE = 100
+MAX_BATCH_OPERATIONS = int(os.getenv("MAX_BATCH_OPERATIONS", "1000"))
+IMPORT_BATCH_SIZE = int(os.getenv("IMPORT_BATCH_SIZE", "1000"))
+EXPORT_BATCH_SIZE = int(os.getenv("EXPORT_BATCH_SIZE", "500"))
@@ -1,14 +1,46 @@
+from typing import Awaitable, Callable, Sequence
+
+from sqlalchemy import Select, select
 from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import selectinload
 from fastapi import HTTPException
-from models import Session, Author, ORM_OBJECT, ORM_CLS
+from models import Session, Author, Book, User, ORM_OBJECT, ORM_CLS
+from pagination import (
+    Pagination, SortKey, cursor_values, encode_cursor, keyset_condition, order_by
+)
+
+
+# Relationships are lazy="raise", every read path states what it needs
+BOOK_RELATIONS = (selectinload(Book.authors), selectinload(Book.genres))
+USER_BOOKS = (
+    selectinload(User.books).selectinload(Book.authors),
+    selectinload(User.books).selectinload(Book.genres)
+)
+
+
+def on_commit(session: Session, callback: Callable[..., Awaitable], *args):
+    # The request's transaction is committed by get_session, side effects that must
+    # only happen for committed data (cache invalidation, token revocation) wait for it
+    session.info.setdefault("after_commit", []).append((callback, args))
 
+async def run_after_commit(session: Session):
+    callbacks = session.info.pop("after_commit", [])
+    for callback, args in callbacks:
+        await callback(*args)
+
+def is_unique_violation(err: IntegrityError) -> bool:
+    # asyncpg reports SQLSTATE, sqlite3 (benchmarks, tests) its extended error name
+    return (
+        getattr(err.orig, "pgcode", None) == '23505'
+        or getattr(err.orig, "sqlite_errorname", None) == 'SQLITE_CONSTRAINT_UNIQUE'
+    )
 
 async def add_item(session: Session, item: ORM_OBJECT) -> ORM_OBJECT:
     session.add(item)
     try:
-        await session.commit()
+        await session.flush()
     except IntegrityError as err:
-        if err.orig.pgcode == '23505':
+        if is_unique_violation(err):
             raise HTTPException(
                 status_code=409,
                 detail='Item already exists'
@@ -16,11 +48,59 @@ async def add_item(session: Session, item: ORM_OBJECT) -> ORM_OBJECT:
         raise err
     return item
     
-async def get_item(session: Session, cls: ORM_CLS, item_id: int) -> ORM_OBJECT:
-    orm_obj = await session.get(cls, item_id)
+async def get_item(
+    session: Session, cls: ORM_CLS, item_id: int, options: Sequence = (), for_update: bool = False
+) -> ORM_OBJECT:
+    # for_update: SELECT ... FOR UPDATE, values read from the row stay current until commit
+    orm_obj = await session.get(cls, item_id, options=options, with_for_update=for_update or None)
     if orm_obj is None:
         raise HTTPException(
             status_code=404,
             detail=f'{cls.__name__} not found'
         )
     return orm_obj
+
+async def get_items(
+    session: Session, cls: ORM_CLS, item_ids: list[int]
+) -> list[ORM_OBJECT]:
+    if not item_ids:
+        return []
+    result = await session.scalars(select(cls).where(cls.id.in_(set(item_ids))))
+    found = {orm_obj.id: orm_obj for orm_obj in result}
+    for item_id in item_ids:
+        if item_id not in found:
+            raise HTTPException(
+                status_code=404,
+                detail=f'{cls.__name__} {item_id} not found'
+            )
+    return [found[item_id] for item_id in dict.fromkeys(item_ids)]
+
+async def paginate(
+    session: Session,
+    query: Select,
+    pagination: Pagination,
+    keys: list[SortKey] | None = None,
+    entities: bool = True
+) -> dict:
+    # entities=False pages plain column selects, items are then the rows themselves
+    if keys is None:
+        entity = query.column_descriptions[0]["entity"]
+        keys = [SortKey("id", entity.id)]
+    if pagination.after is not None:
+        after = cursor_values(keys, pagination.after)
+        query = query.where(keyset_condition(keys, after))
+    query = query.order_by(*order_by(keys)).limit(pagination.limit + 1)
+    result = await session.execute(query)
+    rows = result.all()
+    next_cursor = None
+    if len(rows) > pagination.limit:
+        rows = rows[:pagination.limit]
+        last = rows[-1]
+        next_cursor = encode_cursor({
+            key.name: last._mapping[key.name] if key.name in last._mapping
+            else getattr(last[0], key.name)
+            for key in keys
+        })
+    if not entities:
+        return {"items": rows, "next_cursor": next_cursor}
+    return {"items": [row[0] for row in rows], "next_cursor": next_cursor}
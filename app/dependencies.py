@@ -1,16 +1,80 @@
+from contextlib import asynccontextmanager
+from dataclasses import dataclass
 from typing import Annotated, Any, Dict, Optional
-from fastapi import Depends, HTTPException, Query
-from sqlalchemy import select
+from fastapi import Depends, HTTPException, Query, Request
+from sqlalchemy import Select, select
+from sqlalchemy.exc import DBAPIError
+from sqlalchemy.ext.asyncio import AsyncSession
 
-from models import Session, UserRole, User, Book, Author, Genre
+from models import Session, UserRole, User, Book, Author, Genre, engine
 from auth import get_current_user
+from config import DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE
+from crud import BOOK_RELATIONS, paginate, run_after_commit
+from fieldsets import BOOK_SHAPE, USER_SHAPE, FieldSet, load_options, select_fields
+from pagination import Pagination, SortKey, decode_cursor
+from search import full_text_search, text_match
+from replicas import replica_router
+from throttle import admission
 
 
-async def get_session():
-    async with Session() as session:
-        return session
+SAFE_METHODS = ("GET", "HEAD", "OPTIONS")
+
+
+async def open_session(session_factory) -> AsyncSession:
+    # Connects right away, for callers that must know the database is reachable
+    # before the handler runs
+    session = session_factory()
+    try:
+        await session.connection()
+    except BaseException:
+        await session.close()
+        raise
+    return session
+
+@asynccontextmanager
+async def transaction(session: AsyncSession):
+    # One session and one transaction per request: committed when the handler
+    # returns, rolled back if it raises. The session checks a connection out on its
+    # first statement, so work before that (password hashing, throttling, cache hits)
+    # does not hold one
+    try:
+        yield session
+        await session.commit()
+    except BaseException:
+        await session.rollback()
+        session.info.pop("after_commit", None)
+        raise
+    finally:
+        await session.close()
+    await run_after_commit(session)
+
+async def get_session(request: Request):
+    async with transaction(Session()) as session:
+        yield session
+    if request.method not in SAFE_METHODS:
+        replica_router.pin(request)
+
+async def open_read_session(request: Request) -> AsyncSession:
+    # Read-only work: a healthy replica unless the client is pinned to the primary.
+    # A replica session connects up front, an unreachable replica is marked down and
+    # the primary, which connects lazily as usual, is used instead
+    replica = replica_router.choose(request)
+    if replica is not None:
+        try:
+            session = await open_session(replica.sessionmaker)
+        except (OSError, DBAPIError) as err:
+            replica_router.mark_down(replica, err)
+        else:
+            request.state.replica_read = True
+            return session
+    return Session()
+
+async def get_read_session(request: Request):
+    async with transaction(await open_read_session(request)) as session:
+        yield session
 
 SessionDependency = Annotated[Session, Depends(get_session, use_cache=True)]
+ReadSessionDependency = Annotated[Session, Depends(get_read_session, use_cache=True)]
 
 def require_role(role: UserRole):
     def role_dependency(current_user_data: dict = Depends(get_current_user)):
@@ -24,26 +88,96 @@ def require_role(role: UserRole):
 
 UserAdminDependency = Annotated[User, Depends(require_role(UserRole.admin))]
 
+async def check_admission(request: Request):
+    # Declared before the session, so a throttled client is turned away before
+    # anything touches the database. The email itself is validated with the rest of
+    # the body afterwards; a body that is not JSON only counts against the IP and
+    # then fails validation (422)
+    try:
+        body = await request.json()
+    except ValueError:
+        body = None
+    email = body.get("email") if isinstance(body, dict) else None
+    await admission.admit(request, email if isinstance(email, str) else None)
+
+AdmissionDependency = Annotated[None, Depends(check_admission)]
+
 TokenDependency = Annotated[dict, Depends(get_current_user)]
 
-async def get_filters(
-    session: SessionDependency,
+def get_pagination(
+    cursor: Optional[str] = Query(default=None, description="Курсор следующей страницы"),
+    limit: int = Query(
+        default=DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE, description="Размер страницы"
+    )
+) -> Pagination:
+    after = decode_cursor(cursor) if cursor is not None else None
+    return Pagination(limit=limit, after=after)
+
+PaginationDependency = Annotated[Pagination, Depends(get_pagination)]
+
+def get_book_fields(
+    fields: Optional[str] = Query(
+        default=None, description="Поля книги через запятую, например id,title,available_stock"
+    ),
+    expand: Optional[str] = Query(default=None, description="Загружаемые связи: authors, genres")
+) -> FieldSet | None:
+    return select_fields(BOOK_SHAPE, fields, expand)
+
+BookFieldsDependency = Annotated[FieldSet | None, Depends(get_book_fields)]
+
+def get_user_fields(
+    fields: Optional[str] = Query(
+        default=None, description="Поля пользователя через запятую, например id,name,books.title"
+    ),
+    expand: Optional[str] = Query(
+        default=None, description="Загружаемые связи: books, books.authors, books.genres"
+    )
+) -> FieldSet | None:
+    return select_fields(USER_SHAPE, fields, expand)
+
+UserFieldsDependency = Annotated[FieldSet | None, Depends(get_user_fields)]
+
+@dataclass
+class BookQuery:
+    query: Select
+    keys: list[SortKey]
+
+async def get_book_query(
+    q: Optional[str] = Query(
+        default=None, description="Полнотекстовый поиск по названию и описанию"
+    ),
     title: Optional[str] = Query(default=None, description="Поиск по заголовку"),
     release_year: Optional[int] = Query(default=None, description="Поиск по году выпуска"),
     author: Optional[str] = Query(default=None, description="Поиск по авторам"),
     genre: Optional[str] = Query(default=None, description="Поиск по жанрам")
-) -> Dict[str, Any]:
+) -> BookQuery:
+    # Replicas run the primary's database, the dialect is the same everywhere
+    dialect = engine.dialect.name
+    # Loader options are up to the consumer: the listing narrows them to the
+    # requested fields, the export loads everything
     query = select(Book).where(Book.available_stock > 0)
     if title is not None:
-        query = query.where(Book.title.icontains(title))
+        query = query.where(text_match(Book.title, title, dialect))
     if release_year is not None:
         query = query.where(Book.release_year == release_year)
     if author is not None:
-        query = query.join(Book.authors).filter(Author.name.icontains(author))
+        query = query.where(Book.authors.any(text_match(Author.name, author, dialect)))
     if genre is not None:
-        query = query.join(Book.genres).filter(Genre.name.icontains(genre))
-    result = await session.execute(query)
-    books = result.unique().scalars().all()
-    return books
+        query = query.where(Book.genres.any(text_match(Genre.name, genre, dialect)))
+    keys = [SortKey("id", Book.id)]
+    if q is not None:
+        query, keys = full_text_search(query, q, dialect)
+    return BookQuery(query=query, keys=keys)
+
+BookQueryDependency = Annotated[BookQuery, Depends(get_book_query)]
+
+async def get_filters(
+    session: ReadSessionDependency,
+    pagination: PaginationDependency,
+    book_query: BookQueryDependency,
+    book_fields: BookFieldsDependency
+) -> Dict[str, Any]:
+    options = BOOK_RELATIONS if book_fields is None else load_options(book_fields)
+    return await paginate(session, book_query.query.options(*options), pagination, book_query.keys)
 
 FiltersDependency = Annotated[Dict[str, Any], Depends(get_filters)]
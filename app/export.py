@@ -0,0 +1,61 @@
+import csv
+import io
+from typing import AsyncIterator
+
+from fastapi import Request
+
+from models import Book
+from crud import BOOK_RELATIONS
+from dependencies import BookQuery, open_read_session
+from pagination import order_by
+from serialize import book_record, dump
+
+
+CSV_COLUMNS = [
+    "id", "title", "description", "release_year", "authors", "genres", "available_stock"
+]
+MEDIA_TYPES = {"ndjson": "application/x-ndjson", "csv": "text/csv"}
+
+
+def ndjson_chunk(books: list[Book]) -> bytes:
+    return b"".join(dump(book_record(book)) + b"\n" for book in books)
+
+def csv_chunk(rows: list[list]) -> bytes:
+    buffer = io.StringIO()
+    csv.writer(buffer, lineterminator="\n").writerows(rows)
+    return buffer.getvalue().encode()
+
+def csv_row(book: Book) -> list:
+    return [
+        book.id,
+        book.title,
+        book.description,
+        book.release_year,
+        ";".join(author.name for author in book.authors),
+        ";".join(genre.name for genre in book.genres),
+        book.available_stock
+    ]
+
+async def stream_books(
+    request: Request, book_query: BookQuery, format: str, batch_size: int
+) -> AsyncIterator[bytes]:
+    # Runs after the request's dependencies have exited, so it owns its session, on a
+    # replica like the other reads.
+    # yield_per makes the driver use a server-side cursor and keeps one batch in memory;
+    # the selectinload options fetch authors/genres per batch
+    query = (
+        book_query.query
+        .options(*BOOK_RELATIONS)
+        .order_by(*order_by(book_query.keys))
+        .execution_options(yield_per=batch_size)
+    )
+    if format == "csv":
+        yield csv_chunk([CSV_COLUMNS])
+    async with await open_read_session(request) as session:
+        result = await session.stream(query)
+        async for partition in result.partitions():
+            books = [row[0] for row in partition]
+            if format == "csv":
+                yield csv_chunk([csv_row(book) for book in books])
+            else:
+                yield ndjson_chunk(books)
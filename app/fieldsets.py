@@ -0,0 +1,96 @@
+from dataclasses import dataclass
+from typing import NamedTuple
+
+from fastapi import HTTPException
+from sqlalchemy.orm import load_only, selectinload
+
+from models import Author, Book, Genre, User
+
+
+class Shape(NamedTuple):
+    # What a read endpoint can return: fields in response-schema order, the ones
+    # that are relationships map to the shape of the related objects
+    model: type
+    fields: tuple[str, ...]
+    relations: dict[str, "Shape"]
+
+
+NAME_FIELDS = ("name",)
+BOOK_SHAPE = Shape(
+    Book,
+    ("id", "title", "description", "release_year", "authors", "genres", "available_stock"),
+    {"authors": Shape(Author, NAME_FIELDS, {}), "genres": Shape(Genre, NAME_FIELDS, {})}
+)
+USER_SHAPE = Shape(User, ("id", "name", "email", "role", "books"), {"books": BOOK_SHAPE})
+
+
+@dataclass(frozen=True)
+class FieldSet:
+    shape: Shape
+    fields: tuple[str, ...]
+    nested: dict[str, "FieldSet"]
+
+    @property
+    def columns(self) -> list[str]:
+        return [field for field in self.fields if field not in self.nested]
+
+    @property
+    def key(self) -> str:
+        # Canonical form for cache keys: "id,title,authors(name)"
+        return ",".join(
+            f"{field}({self.nested[field].key})" if field in self.nested else field
+            for field in self.fields
+        )
+
+
+def split_paths(value: str | None) -> list[list[str]]:
+    if value is None:
+        return []
+    return [item.strip().split(".") for item in value.split(",") if item.strip()]
+
+def select_fields(shape: Shape, fields: str | None, expand: str | None) -> FieldSet | None:
+    # Neither parameter: the full response, as before. Otherwise at every level only
+    # the named columns (all of them when none is named) and only the relationships
+    # named in expand or in fields ("authors", "books.title") are returned and loaded.
+    if fields is None and expand is None:
+        return None
+    return narrow(shape, split_paths(fields), split_paths(expand), "")
+
+def narrow(shape: Shape, fields: list[list[str]], expand: list[list[str]], prefix: str) -> FieldSet:
+    for path in fields + expand:
+        name = path[0]
+        if name not in shape.fields:
+            raise HTTPException(status_code=400, detail=f"Unknown field: {prefix}{name}")
+        if name not in shape.relations and (len(path) > 1 or path in expand):
+            raise HTTPException(status_code=400, detail=f"Not a relationship: {prefix}{name}")
+    columns = {path[0] for path in fields if path[0] not in shape.relations}
+    relations = {path[0] for path in fields + expand if path[0] in shape.relations}
+    selected = tuple(
+        field for field in shape.fields
+        if field in relations or (field not in shape.relations and (not columns or field in columns))
+    )
+    nested = {
+        name: narrow(
+            shape.relations[name],
+            [path[1:] for path in fields if path[0] == name and len(path) > 1],
+            [path[1:] for path in expand if path[0] == name and len(path) > 1],
+            f"{prefix}{name}."
+        )
+        for name in selected if name in relations
+    }
+    return FieldSet(shape, selected, nested)
+
+def load_options(fieldset: FieldSet, parent=None) -> list:
+    # load_only for the selected columns (the primary key always comes along) and a
+    # selectinload per expanded relationship; raiseload turns any other attribute
+    # access into an error instead of a hidden query
+    model = fieldset.shape.model
+    columns = [getattr(model, name) for name in fieldset.columns] or [model.id]
+    options = [] if parent is not None else [load_only(*columns, raiseload=True)]
+    for name, nested in fieldset.nested.items():
+        attribute = getattr(model, name)
+        loader = parent.selectinload(attribute) if parent is not None else selectinload(attribute)
+        nested_columns = [getattr(nested.shape.model, column) for column in nested.columns]
+        options.append(loader.load_only(*(nested_columns or [nested.shape.model.id]), raiseload=True))
+        options += load_options(nested, loader)
+    return options
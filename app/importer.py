@@ -0,0 +1,169 @@
+import csv
+import json
+from collections import Counter
+from typing import AsyncIterator
+
+from pydantic import ValidationError
+from sqlalchemy import insert, select
+from sqlalchemy.exc import SQLAlchemyError
+
+from models import Session, Author, Book, Genre, book_author, book_genre
+from schema import AddBook
+from suggest import suggest_index
+import stats
+
+
+def book_values(book: AddBook) -> dict:
+    return {
+        "title": book.title,
+        "description": book.description or "",
+        "release_year": book.release_year,
+        "available_stock": book.available_stock
+    }
+
+async def iter_lines(stream: AsyncIterator[bytes]) -> AsyncIterator[str]:
+    buffer = b""
+    async for chunk in stream:
+        buffer += chunk
+        *lines, buffer = buffer.split(b"\n")
+        for line in lines:
+            yield line.decode().rstrip("\r")
+    if buffer:
+        yield buffer.decode().rstrip("\r")
+
+async def iter_ndjson(lines: AsyncIterator[str]) -> AsyncIterator[tuple[int, dict | str]]:
+    number = 0
+    async for line in lines:
+        number += 1
+        if not line.strip():
+            continue
+        try:
+            yield number, json.loads(line)
+        except ValueError as err:
+            yield number, f"Invalid JSON: {err}"
+
+async def iter_csv(lines: AsyncIterator[str]) -> AsyncIterator[tuple[int, dict | str]]:
+    # Authors and genres are ';'-separated ids; quoted fields may span lines
+    header = None
+    number = 0
+    pending, start = [], 0
+    async for line in lines:
+        number += 1
+        if not pending:
+            start = number
+        pending.append(line)
+        text = "\n".join(pending)
+        if text.count('"') % 2:
+            continue
+        pending = []
+        if not text.strip():
+            continue
+        row = next(csv.reader([text]))
+        if header is None:
+            header = [name.strip() for name in row]
+            continue
+        if len(row) != len(header):
+            yield start, f"Expected {len(header)} columns, got {len(row)}"
+            continue
+        record = dict(zip(header, row))
+        for field in ("authors", "genres"):
+            value = record.get(field)
+            if value is not None:
+                record[field] = [item for item in value.split(";") if item.strip()]
+        if record.get("description") == "":
+            record["description"] = None
+        yield start, record
+    if pending:
+        yield start, "Unterminated quoted field"
+
+
+class BookImporter:
+    def __init__(self, session: Session, batch_size: int):
+        self.session = session
+        self.batch_size = batch_size
+        self.imported = 0
+        self.errors: list[dict] = []
+        self._batch: list[tuple[int, AddBook]] = []
+
+    def error(self, line: int, detail: str):
+        self.errors.append({"line": line, "detail": detail})
+
+    async def add(self, line: int, record: dict | str):
+        if isinstance(record, str):
+            self.error(line, record)
+            return
+        try:
+            book = AddBook.model_validate(record)
+        except ValidationError as err:
+            self.error(line, "; ".join(
+                f"{'.'.join(map(str, e['loc']))}: {e['msg']}" for e in err.errors()
+            ))
+            return
+        self._batch.append((line, book))
+        if len(self._batch) >= self.batch_size:
+            await self.flush()
+
+    async def existing_ids(self, cls, ids: set[int]) -> set[int]:
+        if not ids:
+            return set()
+        result = await self.session.scalars(select(cls.id).where(cls.id.in_(ids)))
+        return set(result)
+
+    async def flush(self):
+        batch, self._batch = self._batch, []
+        if not batch:
+            return
+        authors = await self.existing_ids(Author, {i for _, book in batch for i in book.authors})
+        genres = await self.existing_ids(Genre, {i for _, book in batch for i in book.genres})
+        rows = []
+        for line, book in batch:
+            missing = [f"Author {i}" for i in book.authors if i not in authors]
+            missing += [f"Genre {i}" for i in book.genres if i not in genres]
+            if missing:
+                self.error(line, f"{', '.join(missing)} not found")
+            else:
+                rows.append((line, book))
+        if not rows:
+            return
+        try:
+            result = await self.session.execute(
+                insert(Book).returning(Book.id, sort_by_parameter_order=True),
+                [book_values(book) for _, book in rows]
+            )
+            book_ids = result.scalars().all()
+            author_links = [
+                {"book_id": book_id, "author_id": author_id}
+                for book_id, (_, book) in zip(book_ids, rows)
+                for author_id in dict.fromkeys(book.authors)
+            ]
+            genre_links = [
+                {"book_id": book_id, "genre_id": genre_id}
+                for book_id, (_, book) in zip(book_ids, rows)
+                for genre_id in dict.fromkeys(book.genres)
+            ]
+            if author_links:
+                await self.session.execute(insert(book_author), author_links)
+            if genre_links:
+                await self.session.execute(insert(book_genre), genre_links)
+            await stats.adjust_books(
+                self.session,
+                books=len(rows),
+                available_stock=sum(book.available_stock for _, book in rows),
+                authors=Counter(link["author_id"] for link in author_links),
+                genres=Counter(link["genre_id"] for link in genre_links)
+            )
+            await self.session.commit()
+        except SQLAlchemyError as err:
+            await self.session.rollback()
+            for line, _ in rows:
+                self.error(line, f"Batch failed: {err.__class__.__name__}")
+            return
+        await suggest_index.books_added({
+            book_id: book.title for book_id, (_, book) in zip(book_ids, rows)
+        })
+        self.imported += len(rows)
+
+    @property
+    def report(self) -> dict:
+        errors = sorted(self.errors, key=lambda error: error["line"])
+        return {"imported": self.imported, "errors": errors}
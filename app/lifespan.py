@@ -1,15 +1,38 @@
+import asyncio
 from contextlib import asynccontextmanager
 
 from fastapi import FastAPI
-from models import Base, engine
+from models import engine
+import auth
+from config import DB_STARTUP
+from migrations import migrate, schema_state
+from overdue import overdue_scanner
+from replicas import replica_router
+from similar import similar_books
+from suggest import suggest_index
 
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     print("START")
-    async with engine.begin() as conn:
-        # await conn.run_sync(Base.metadata.drop_all)
-        await conn.run_sync(Base.metadata.create_all)
+    if DB_STARTUP == "migrate":
+        await migrate(engine)
+    if DB_STARTUP == "lazy":
+        # Engines connect on first use, nothing here waits for the database
+        version_check = asyncio.create_task(schema_state.check(engine))
+    else:
+        await schema_state.check(engine)
+    auth.revocation_backend.start()
+    overdue_scanner.start()
+    replica_router.start()
+    similar_books.start()
+    suggest_index.start()
     yield
+    await suggest_index.stop()
+    await similar_books.stop()
+    await replica_router.stop()
+    await overdue_scanner.stop()
+    await auth.revocation_backend.stop()
+    auth.password_hasher.shutdown()
     print("FINISH")
     
\ No newline at end of file
@@ -0,0 +1,38 @@
+"""Applies schema migrations, the only place DDL runs.
+
+    python migrate.py            # upgrade to the latest version
+    python migrate.py --to 2     # upgrade up to version 2
+    python migrate.py current    # print the database version
+    python migrate.py history    # list all versions
+"""
+import argparse
+import asyncio
+import logging
+
+from migrations import HEAD, MIGRATIONS, current_version, migrate
+from models import engine
+
+
+async def main(args):
+    try:
+        if args.command == "current":
+            version = await current_version(engine)
+            print(f"{version} (latest {HEAD})")
+        elif args.command == "history":
+            version = await current_version(engine)
+            for migration in MIGRATIONS:
+                mark = "x" if migration.version <= version else " "
+                print(f"[{mark}] {migration.version}: {migration.description}")
+        else:
+            applied = await migrate(engine, args.to)
+            print(f"Applied {len(applied)} migration(s), database is at version {await current_version(engine)}")
+    finally:
+        await engine.dispose()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("command", nargs="?", default="upgrade", choices=("upgrade", "current", "history"))
+    parser.add_argument("--to", type=int, default=HEAD, help="target version for upgrade")
+    logging.basicConfig(level=logging.WARNING, format="%(message)s")
+    asyncio.run(main(parser.parse_args()))
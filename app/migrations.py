@@ -0,0 +1,314 @@
+import asyncio
+import datetime
+import logging
+import time
+from typing import Awaitable, Callable, NamedTuple
+
+from sqlalchemy import (Column, DateTime, Float, ForeignKey, Index, Integer, MetaData, String,
+                        Table, delete, func, insert, literal, select, text)
+from sqlalchemy.exc import DBAPIError
+from sqlalchemy.ext.asyncio import AsyncConnection, AsyncEngine
+
+from config import SCHEMA_RECHECK_INTERVAL
+
+
+logger = logging.getLogger(__name__)
+
+# Kept out of Base.metadata: it describes the schema instead of being part of it
+schema_version = Table(
+    "schema_version",
+    MetaData(),
+    Column("version", Integer, primary_key=True, autoincrement=False),
+    Column("description", String(200), nullable=False),
+    Column("applied_at", DateTime, nullable=False, default=datetime.datetime.now),
+)
+# pg_advisory_xact_lock key, concurrent `migrate` runs apply each step once
+MIGRATION_LOCK = 0x6C696272
+
+
+# Schema of steps 1-3. Steps use these frozen definitions, never the models:
+# a model change must not change what an already released step creates, it
+# gets a new step with its own DDL instead.
+v1 = MetaData()
+
+v1_users = Table(
+    "users", v1,
+    Column("id", Integer, primary_key=True),
+    Column("name", String(100), nullable=False),
+    Column("email", String(100), nullable=False, unique=True),
+    Column("password", String(100), nullable=False),
+    Column("role", String(100), nullable=False),
+)
+v1_authors = Table(
+    "authors", v1,
+    Column("id", Integer, primary_key=True),
+    Column("name", String(100), nullable=False),
+    Column("biography", String(1000), nullable=False),
+    Column("date_of_birth", DateTime, nullable=False),
+)
+v1_genres = Table(
+    "genres", v1,
+    Column("id", Integer, primary_key=True),
+    Column("name", String(100), nullable=False, unique=True),
+)
+v1_books = Table(
+    "books", v1,
+    Column("id", Integer, primary_key=True),
+    Column("title", String(100), nullable=False),
+    Column("description", String(1000), nullable=False),
+    Column("release_year", Integer, nullable=False),
+    Column("available_stock", Integer, nullable=False),
+)
+v1_book_genre = Table(
+    "book_genre", v1,
+    Column("book_id", ForeignKey("books.id"), primary_key=True, index=True),
+    Column("genre_id", ForeignKey("genres.id"), primary_key=True, index=True),
+)
+v1_book_author = Table(
+    "book_author", v1,
+    Column("book_id", ForeignKey("books.id"), primary_key=True, index=True),
+    Column("author_id", ForeignKey("authors.id"), primary_key=True, index=True),
+)
+v1_book_user = Table(
+    "book_user", v1,
+    Column("book_id", ForeignKey("books.id"), primary_key=True, index=True),
+    Column("user_id", ForeignKey("users.id"), primary_key=True, index=True),
+    Column("rent_date", DateTime, nullable=False),
+    Column("return_date", DateTime, nullable=True),
+    Index("ix_book_user_return_date", "return_date", "book_id", "user_id"),
+)
+v1_catalog_stats = Table(
+    "catalog_stats", v1,
+    Column("slot", Integer, primary_key=True, autoincrement=False),
+    Column("books", Integer, nullable=False),
+    Column("available_stock", Integer, nullable=False),
+    Column("rented", Integer, nullable=False),
+)
+v1_genre_stats = Table(
+    "genre_stats", v1,
+    Column(
+        "genre_id", ForeignKey("genres.id", ondelete="CASCADE"),
+        primary_key=True, autoincrement=False
+    ),
+    Column("books", Integer, nullable=False),
+)
+v1_author_stats = Table(
+    "author_stats", v1,
+    Column(
+        "author_id", ForeignKey("authors.id", ondelete="CASCADE"),
+        primary_key=True, autoincrement=False
+    ),
+    Column("books", Integer, nullable=False),
+)
+v1_rental_stats = Table(
+    "rental_stats", v1,
+    Column(
+        "book_id", ForeignKey("books.id", ondelete="CASCADE"),
+        primary_key=True, autoincrement=False
+    ),
+    Column("rentals", Integer, nullable=False),
+    Index("ix_rental_stats_rentals", "rentals", "book_id"),
+)
+
+for name, column in (
+    ("ix_books_title_trgm", v1_books.c.title),
+    ("ix_authors_name_trgm", v1_authors.c.name),
+    ("ix_genres_name_trgm", v1_genres.c.name),
+):
+    Index(
+        name, column, postgresql_using="gin", postgresql_ops={column.key: "gin_trgm_ops"}
+    ).ddl_if(dialect="postgresql")
+Index(
+    "ix_books_search",
+    func.to_tsvector(
+        text("'simple'::regconfig"),
+        func.coalesce(v1_books.c.title, text("''"))
+        + text("' '")
+        + func.coalesce(v1_books.c.description, text("''"))
+    ),
+    postgresql_using="gin"
+).ddl_if(dialect="postgresql")
+
+V1_BOOKS_FTS_DDL = (
+    "CREATE VIRTUAL TABLE IF NOT EXISTS books_fts USING fts5("
+    "title, description, content='books', content_rowid='id', "
+    "tokenize='unicode61 remove_diacritics 2')",
+    "CREATE TRIGGER IF NOT EXISTS books_fts_ai AFTER INSERT ON books BEGIN "
+    "INSERT INTO books_fts(rowid, title, description) "
+    "VALUES (new.id, new.title, new.description); END",
+    "CREATE TRIGGER IF NOT EXISTS books_fts_ad AFTER DELETE ON books BEGIN "
+    "INSERT INTO books_fts(books_fts, rowid, title, description) "
+    "VALUES ('delete', old.id, old.title, old.description); END",
+    "CREATE TRIGGER IF NOT EXISTS books_fts_au AFTER UPDATE ON books BEGIN "
+    "INSERT INTO books_fts(books_fts, rowid, title, description) "
+    "VALUES ('delete', old.id, old.title, old.description); "
+    "INSERT INTO books_fts(rowid, title, description) "
+    "VALUES (new.id, new.title, new.description); END",
+)
+
+# Step 4
+v4 = MetaData()
+
+v4_revoked_tokens = Table(
+    "revoked_tokens", v4,
+    Column("id", Integer, primary_key=True),
+    Column("token_key", String(64), nullable=True),
+    Column("user_id", Integer, nullable=True),
+    Column("issued_before", Float, nullable=True),
+    Column("expires_at", Float, nullable=False),
+    Column("revoked_at", Float, nullable=False),
+    Index("ix_revoked_tokens_revoked_at", "revoked_at"),
+    Index("ix_revoked_tokens_expires_at", "expires_at"),
+)
+
+
+class Migration(NamedTuple):
+    version: int
+    description: str
+    upgrade: Callable[[AsyncConnection], Awaitable[None]]
+
+
+async def create_tables(conn: AsyncConnection):
+    # Creates missing tables only, databases from before versioning keep theirs
+    if conn.dialect.name == "postgresql":
+        await conn.execute(text("CREATE EXTENSION IF NOT EXISTS pg_trgm"))
+    await conn.run_sync(v1.create_all)
+
+async def create_indexes(conn: AsyncConnection):
+    # Indexes added to tables that already existed, create_all skips those
+    dialect = conn.dialect.name
+    if dialect == "postgresql":
+        await conn.execute(text("CREATE EXTENSION IF NOT EXISTS pg_trgm"))
+    for table in v1.sorted_tables:
+        for index in table.indexes:
+            await conn.run_sync(index.create, checkfirst=True)
+    if dialect == "sqlite":
+        for statement in V1_BOOKS_FTS_DDL:
+            await conn.execute(text(statement))
+        await conn.execute(text("INSERT INTO books_fts(books_fts) VALUES ('rebuild')"))
+
+async def backfill_stats(conn: AsyncConnection):
+    # Summaries recomputed from the base tables; rental history is not kept, so the
+    # most-rented counters start from the current loans
+    for table in (v1_catalog_stats, v1_genre_stats, v1_author_stats, v1_rental_stats):
+        await conn.execute(delete(table))
+    await conn.execute(insert(v1_catalog_stats).from_select(
+        ["slot", "books", "available_stock", "rented"],
+        select(
+            literal(0),
+            select(func.count()).select_from(v1_books).scalar_subquery(),
+            select(func.coalesce(func.sum(v1_books.c.available_stock), 0)).scalar_subquery(),
+            select(func.count()).select_from(v1_book_user).scalar_subquery()
+        )
+    ))
+    for table, links, key, count_column in (
+        (v1_genre_stats, v1_book_genre, "genre_id", "books"),
+        (v1_author_stats, v1_book_author, "author_id", "books"),
+        (v1_rental_stats, v1_book_user, "book_id", "rentals")
+    ):
+        await conn.execute(insert(table).from_select(
+            [key, count_column],
+            select(links.c[key], func.count()).group_by(links.c[key])
+        ))
+
+async def create_revocation_table(conn: AsyncConnection):
+    await conn.run_sync(v4.create_all)
+
+# Append only: a released step is never edited, schema changes get a new version
+MIGRATIONS = [
+    Migration(1, "Base tables", create_tables),
+    Migration(2, "Search, link and due-date indexes", create_indexes),
+    Migration(3, "Statistics backfill", backfill_stats),
+    Migration(4, "Shared token revocation list", create_revocation_table),
+]
+HEAD = MIGRATIONS[-1].version
+
+
+async def current_version(engine: AsyncEngine) -> int:
+    # One indexed query; a database without the table has never been migrated
+    try:
+        async with engine.connect() as conn:
+            return await conn.scalar(select(func.coalesce(func.max(schema_version.c.version), 0)))
+    except DBAPIError as err:
+        if "schema_version" not in str(err.orig):
+            raise
+        return 0
+
+async def migrate(engine: AsyncEngine, target: int = HEAD) -> list[Migration]:
+    async with engine.begin() as conn:
+        await conn.run_sync(schema_version.create, checkfirst=True)
+    applied = []
+    for migration in MIGRATIONS:
+        if migration.version > target:
+            break
+        # One transaction per step, Postgres DDL is transactional so a failed step
+        # leaves the previous version in place
+        async with engine.begin() as conn:
+            if conn.dialect.name == "postgresql":
+                await conn.execute(select(func.pg_advisory_xact_lock(MIGRATION_LOCK)))
+            version = await conn.scalar(select(func.coalesce(func.max(schema_version.c.version), 0)))
+            if version >= migration.version:
+                continue
+            logger.warning("Applying migration %s: %s", migration.version, migration.description)
+            await migration.upgrade(conn)
+            await conn.execute(insert(schema_version).values(
+                version=migration.version, description=migration.description
+            ))
+        applied.append(migration)
+    return applied
+
+
+class SchemaState:
+    # Set by the startup check. A degraded state is checked again on demand (see
+    # refresh), so a database that comes up or gets migrated later is picked up
+    # without a restart; a healthy one is never re-queried.
+    def __init__(self, recheck_interval: float):
+        self.recheck_interval = recheck_interval
+        self.version: int | None = None
+        self.error: str | None = None
+        self.checked_at: float | None = None
+        self._lock = asyncio.Lock()
+
+    @property
+    def degraded(self) -> bool:
+        return self.version != HEAD
+
+    def report(self) -> dict:
+        return {
+            "status": "degraded" if self.degraded else "ok",
+            "schema_version": self.version,
+            "expected_schema_version": HEAD,
+            "detail": self.error
+        }
+
+    async def check(self, engine: AsyncEngine):
+        self.checked_at = time.monotonic()
+        try:
+            self.version = await current_version(engine)
+            self.error = None
+        except (OSError, DBAPIError) as err:
+            self.version = None
+            self.error = f"Database unavailable: {err.__class__.__name__}"
+        if self.error is None and self.version < HEAD:
+            self.error = f"Schema version {self.version} is behind {HEAD}, run migrate.py"
+        elif self.error is None and self.version > HEAD:
+            self.error = f"Schema version {self.version} is newer than this release ({HEAD})"
+        if self.error is not None:
+            logger.warning("Schema check degraded: %s", self.error)
+
+    async def refresh(self, engine: AsyncEngine):
+        # At most one check per recheck_interval, concurrent callers wait for it
+        if not self.degraded:
+            return
+        async with self._lock:
+            if (
+                self.checked_at is not None
+                and time.monotonic() - self.checked_at < self.recheck_interval
+            ):
+                return
+            await self.check(engine)
+            if not self.degraded:
+                logger.warning("Schema version %s is current, no longer degraded", self.version)
+
+
+schema_state = SchemaState(SCHEMA_RECHECK_INTERVAL)
@@ -1,18 +1,46 @@
 import datetime
 from enum import Enum
 
-from sqlalchemy import (UUID, Boolean, CheckConstraint, Column, DateTime,
-                        ForeignKey, Integer, String, Table, UniqueConstraint,
-                        func)
+from sqlalchemy import (UUID, Boolean, CheckConstraint, Column, DateTime, Float,
+                        ForeignKey, Index, Integer, String, Table,
+                        UniqueConstraint, func, text)
 from sqlalchemy.ext.asyncio import AsyncAttrs, async_sessionmaker, create_async_engine
 from sqlalchemy.orm import DeclarativeBase, Mapped, mapped_column, relationship
 
-from config import DSN
+from pool_stats import TimedQueuePool
+from config import (
+    DSN, RENT_PERIOD_DAYS, DB_POOL_SIZE, DB_MAX_OVERFLOW, DB_POOL_TIMEOUT, DB_POOL_RECYCLE,
+    DB_POOL_PRE_PING, DB_STATEMENT_CACHE_SIZE, REPLICA_DSNS
+)
 # from extra_types import ModelName
 
 
-engine = create_async_engine(DSN)
+def make_engine(dsn: str, pool_size: int = DB_POOL_SIZE, max_overflow: int = DB_MAX_OVERFLOW):
+    if dsn.startswith("sqlite"):
+        # SQLite (tests, benchmarks) keeps SQLAlchemy's default pooling
+        return create_async_engine(dsn)
+    connect_args = {}
+    if dsn.startswith("postgresql+asyncpg"):
+        # SQLAlchemy's prepared statement cache and asyncpg's own statement cache
+        connect_args = {
+            "prepared_statement_cache_size": DB_STATEMENT_CACHE_SIZE,
+            "statement_cache_size": DB_STATEMENT_CACHE_SIZE
+        }
+    return create_async_engine(
+        dsn,
+        poolclass=TimedQueuePool,
+        pool_size=pool_size,
+        max_overflow=max_overflow,
+        pool_timeout=DB_POOL_TIMEOUT,
+        pool_recycle=DB_POOL_RECYCLE,
+        pool_pre_ping=DB_POOL_PRE_PING,
+        connect_args=connect_args
+    )
+
+
+engine = make_engine(DSN)
 Session = async_sessionmaker(bind=engine, expire_on_commit=False)
+replica_engines = [make_engine(dsn) for dsn in REPLICA_DSNS]
 
 
 class Base(DeclarativeBase, AsyncAttrs):
@@ -37,11 +65,13 @@ book_user = Table(
     Base.metadata,
     Column("book_id", ForeignKey("books.id"), primary_key=True, index=True),
     Column("user_id", ForeignKey("users.id"), primary_key=True, index=True),
-    Column("rent_date", DateTime, nullable=False, default=datetime.datetime.now()),
+    Column("rent_date", DateTime, nullable=False, default=datetime.datetime.now),
     Column(
         "return_date", DateTime, nullable=True,
-        default=datetime.datetime.now() + datetime.timedelta(days=7)
+        default=lambda: datetime.datetime.now() + datetime.timedelta(days=RENT_PERIOD_DAYS)
     ),
+    # Overdue scans walk (return_date, book_id, user_id) from the oldest due date
+    Index("ix_book_user_return_date", "return_date", "book_id", "user_id"),
 )
 
 class UserRole(str, Enum):
@@ -56,15 +86,7 @@ class User(Base):
     email: Mapped[str] = mapped_column(String(100), nullable=False, unique=True)
     password: Mapped[str] = mapped_column(String(100), nullable=False)
     role: Mapped[UserRole] = mapped_column(String(100), nullable=False, default=UserRole.user)
-    books: Mapped[list["Book"]] = relationship("Book", secondary=book_user, lazy="joined")
-
-    @property
-    def dict(self):
-        return {
-            "id": self.id,
-            "name": self.name,
-            "email": self.email
-        }
+    books: Mapped[list["Book"]] = relationship("Book", secondary=book_user, lazy="raise")
 
 class Author(Base):
     __tablename__ = "authors"
@@ -74,15 +96,6 @@ class Author(Base):
     biography: Mapped[str] = mapped_column(String(1000), nullable=False)
     date_of_birth: Mapped[datetime.date] = mapped_column(DateTime, nullable=False)
 
-    @property
-    def dict(self):
-        return {
-            "id": self.id,
-            "name": self.name,
-            "biography": self.biography,
-            "date_of_birth": self.date_of_birth
-        }
-
 class Genre(Base):
     __tablename__ = "genres"
 
@@ -97,24 +110,80 @@ class Book(Base):
     description: Mapped[str] = mapped_column(String(1000))
     release_year: Mapped[int] = mapped_column(Integer, nullable=False)
     authors: Mapped[list["Author"]] = relationship(
-        "Author", secondary=book_author, lazy="joined"
+        "Author", secondary=book_author, lazy="raise"
     )
     genres: Mapped[list["Genre"]] = relationship(
-        "Genre", secondary=book_genre, lazy="joined"
+        "Genre", secondary=book_genre, lazy="raise"
     )
     available_stock: Mapped[int] = mapped_column(Integer, nullable=False)
 
-    @property
-    def dict(self):
-        return {
-            "id": self.id,
-            "title": self.title,
-            "description": self.description,
-            "release_year": self.release_year,
-            "authors": self.authors,
-            "genres": self.genres,
-            "available_stock": self.available_stock
-        }
+# Statistics, kept current by the write paths (see stats.py) so reads never aggregate
+
+class CatalogCounter(Base):
+    # Catalog totals are split over STATS_SLOTS rows, each write bumps a random slot
+    # so concurrent rentals do not queue on a single row lock; readers sum the slots
+    __tablename__ = "catalog_stats"
+
+    slot: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=False)
+    books: Mapped[int] = mapped_column(Integer, nullable=False, default=0)
+    available_stock: Mapped[int] = mapped_column(Integer, nullable=False, default=0)
+    rented: Mapped[int] = mapped_column(Integer, nullable=False, default=0)
+
+class GenreCounter(Base):
+    __tablename__ = "genre_stats"
+
+    genre_id: Mapped[int] = mapped_column(
+        ForeignKey("genres.id", ondelete="CASCADE"), primary_key=True, autoincrement=False
+    )
+    books: Mapped[int] = mapped_column(Integer, nullable=False, default=0)
+    genre: Mapped["Genre"] = relationship("Genre", lazy="raise")
+
+class AuthorCounter(Base):
+    __tablename__ = "author_stats"
+
+    author_id: Mapped[int] = mapped_column(
+        ForeignKey("authors.id", ondelete="CASCADE"), primary_key=True, autoincrement=False
+    )
+    books: Mapped[int] = mapped_column(Integer, nullable=False, default=0)
+    author: Mapped["Author"] = relationship("Author", lazy="raise")
+
+class BookRentalCounter(Base):
+    __tablename__ = "rental_stats"
+    __table_args__ = (Index("ix_rental_stats_rentals", "rentals", "book_id"),)
+
+    book_id: Mapped[int] = mapped_column(
+        ForeignKey("books.id", ondelete="CASCADE"), primary_key=True, autoincrement=False
+    )
+    rentals: Mapped[int] = mapped_column(Integer, nullable=False, default=0)
+    book: Mapped["Book"] = relationship("Book", lazy="raise")
+
+class RevokedToken(Base):
+    # Revocation list shared by the workers (see revocation.py): a single token by its
+    # key, or every token of user_id issued up to issued_before. Timestamps are epoch
+    # seconds like the tokens' own, a row is dropped once expires_at has passed.
+    __tablename__ = "revoked_tokens"
+    __table_args__ = (
+        Index("ix_revoked_tokens_revoked_at", "revoked_at"),
+        Index("ix_revoked_tokens_expires_at", "expires_at"),
+    )
+
+    id: Mapped[int] = mapped_column(Integer, primary_key=True)
+    token_key: Mapped[str | None] = mapped_column(String(64), nullable=True)
+    user_id: Mapped[int | None] = mapped_column(Integer, nullable=True)
+    issued_before: Mapped[float | None] = mapped_column(Float, nullable=True)
+    expires_at: Mapped[float] = mapped_column(Float, nullable=False)
+    revoked_at: Mapped[float] = mapped_column(Float, nullable=False)
+
+
+def book_search_vector():
+    # Must stay identical to the ix_books_search expression (migrations, step 2) for
+    # the index to be used
+    return func.to_tsvector(
+        text("'simple'::regconfig"),
+        func.coalesce(Book.title, text("''"))
+        + text("' '")
+        + func.coalesce(Book.description, text("''"))
+    )
 
 
 ORM_OBJECT = Author | Genre | Book | User
@@ -0,0 +1,114 @@
+import datetime
+import logging
+import time
+from typing import AsyncIterator
+
+from sqlalchemy import Select, select
+
+from config import OVERDUE_SCAN_BATCH_SIZE, OVERDUE_SCAN_INTERVAL, OVERDUE_SINK
+from models import Session, Book, User, book_user
+from pagination import SortKey, keyset_condition, order_by
+from plugins import load_backend
+from periodic import PeriodicTask
+import metrics
+
+
+logger = logging.getLogger(__name__)
+
+# Keyset order of ix_book_user_return_date, "return_date < now" is a range scan of it
+OVERDUE_KEYS = [
+    SortKey("return_date", book_user.c.return_date, datetime.datetime.fromisoformat),
+    SortKey("book_id", book_user.c.book_id),
+    SortKey("user_id", book_user.c.user_id)
+]
+
+
+def overdue_query(until: datetime.datetime, since: datetime.datetime | None = None) -> Select:
+    query = (
+        select(
+            book_user.c.return_date,
+            book_user.c.book_id,
+            book_user.c.user_id,
+            book_user.c.rent_date,
+            Book.title,
+            User.name.label("user_name"),
+            User.email
+        )
+        .join(Book, Book.id == book_user.c.book_id)
+        .join(User, User.id == book_user.c.user_id)
+        .where(book_user.c.return_date < until)
+    )
+    if since is not None:
+        query = query.where(book_user.c.return_date >= since)
+    return query
+
+async def iter_overdue(
+    session: Session,
+    until: datetime.datetime,
+    since: datetime.datetime | None = None,
+    batch_size: int = OVERDUE_SCAN_BATCH_SIZE
+) -> AsyncIterator[list]:
+    query = overdue_query(until, since).order_by(*order_by(OVERDUE_KEYS)).limit(batch_size)
+    after = None
+    while True:
+        batch_query = query if after is None else query.where(keyset_condition(OVERDUE_KEYS, after))
+        rows = (await session.execute(batch_query)).all()
+        if not rows:
+            return
+        yield rows
+        if len(rows) < batch_size:
+            return
+        last = rows[-1]._mapping
+        after = {key.name: last[key.name] for key in OVERDUE_KEYS}
+
+
+class OverdueSink:
+    async def notify(self, loans: list):
+        raise NotImplementedError
+
+
+class LogOverdueSink(OverdueSink):
+    async def notify(self, loans: list):
+        for loan in loans:
+            logger.warning(
+                "Overdue rental: book %s (%s) held by user %s <%s> since %s, due %s",
+                loan.book_id, loan.title, loan.user_id, loan.email, loan.rent_date, loan.return_date
+            )
+
+
+class OverdueScanner(PeriodicTask):
+    # Every scan reports the loans that became overdue since the previous one, so a
+    # loan is reported once per process and the scan only touches the newly overdue
+    # rows; the first scan after start reports everything overdue
+    name = "Overdue scan"
+
+    def __init__(self, sink: OverdueSink, interval: float, batch_size: int):
+        self.sink = sink
+        self.interval = interval
+        self.batch_size = batch_size
+        self.watermark: datetime.datetime | None = None
+
+    async def scan(self) -> int:
+        until = datetime.datetime.now()
+        found = 0
+        started = time.perf_counter()
+        async with Session() as session:
+            async for batch in iter_overdue(session, until, self.watermark, self.batch_size):
+                await self.sink.notify(batch)
+                found += len(batch)
+        self.watermark = until
+        metrics.overdue_scan_duration.observe(time.perf_counter() - started)
+        metrics.overdue_rentals_found.inc(amount=found)
+        return found
+
+    async def tick(self):
+        await self.scan()
+
+    def start(self):
+        if self.interval > 0:
+            super().start()
+
+
+overdue_scanner = OverdueScanner(
+    load_backend(OVERDUE_SINK, LogOverdueSink), OVERDUE_SCAN_INTERVAL, OVERDUE_SCAN_BATCH_SIZE
+)
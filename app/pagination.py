@@ -0,0 +1,64 @@
+import base64
+import datetime
+import json
+from dataclasses import dataclass
+from typing import Any, NamedTuple
+
+from fastapi import HTTPException
+from sqlalchemy import and_, or_
+
+
+class SortKey(NamedTuple):
+    name: str
+    column: Any
+    type: type = int
+    descending: bool = False
+
+
+@dataclass
+class Pagination:
+    limit: int
+    after: dict[str, Any] | None = None
+
+
+def cursor_default(value: Any) -> str:
+    # Dates and datetimes travel as ISO strings, SortKey.type parses them back
+    if isinstance(value, datetime.date):
+        return value.isoformat()
+    raise TypeError(f"Cannot encode {type(value).__name__} in a cursor")
+
+def encode_cursor(key: dict[str, Any]) -> str:
+    raw = json.dumps(key, separators=(",", ":"), default=cursor_default).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+def decode_cursor(cursor: str) -> dict[str, Any]:
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        key = json.loads(raw)
+    except ValueError:
+        key = None
+    if not isinstance(key, dict):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    return key
+
+def cursor_values(keys: list[SortKey], after: dict[str, Any]) -> dict[str, Any]:
+    if set(after) != {key.name for key in keys}:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    try:
+        return {key.name: key.type(after[key.name]) for key in keys}
+    except (TypeError, ValueError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+def keyset_condition(keys: list[SortKey], after: dict[str, Any]):
+    # (a, b) > (x, y)  ->  a > x OR (a = x AND b > y), respecting each key's direction
+    clauses = []
+    for i, key in enumerate(keys):
+        equal = [prev.column == after[prev.name] for prev in keys[:i]]
+        if key.descending:
+            clauses.append(and_(*equal, key.column < after[key.name]))
+        else:
+            clauses.append(and_(*equal, key.column > after[key.name]))
+    return or_(*clauses)
+
+def order_by(keys: list[SortKey]) -> list:
+    return [key.column.desc() if key.descending else key.column.asc() for key in keys]
@@ -0,0 +1,41 @@
+import asyncio
+import logging
+
+
+logger = logging.getLogger(__name__)
+
+
+class PeriodicTask:
+    # Background job of a process-wide singleton, started and stopped by the lifespan:
+    # tick() runs right away and then every `interval` seconds, once when the interval
+    # is not positive. A failed tick is logged and the next one runs as scheduled.
+    name = "Periodic task"
+    interval: float
+    _task: asyncio.Task | None = None
+
+    async def tick(self):
+        raise NotImplementedError
+
+    async def run(self):
+        while True:
+            try:
+                await self.tick()
+            except Exception:
+                logger.exception("%s failed", self.name)
+            if self.interval <= 0:
+                return
+            await asyncio.sleep(self.interval)
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self.run())
+
+    async def stop(self):
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
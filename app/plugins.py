@@ -0,0 +1,15 @@
+import importlib
+
+
+def load_object(path: str):
+    # "package.module:attribute"
+    module_name, _, attribute = path.partition(":")
+    if not attribute:
+        raise ValueError(f"Expected 'module:attribute', got {path!r}")
+    module = importlib.import_module(module_name)
+    return getattr(module, attribute)
+
+def load_backend(path: str | None, default):
+    if not path:
+        return default()
+    return load_object(path)()
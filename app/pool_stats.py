@@ -0,0 +1,55 @@
+import time
+
+from sqlalchemy.ext.asyncio import AsyncEngine
+from sqlalchemy.pool import AsyncAdaptedQueuePool
+
+import metrics
+
+
+class PoolWaitStats:
+    def __init__(self):
+        self.checkouts = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+
+    def record_wait(self, seconds: float):
+        self.checkouts += 1
+        self.total_wait += seconds
+        if seconds > self.max_wait:
+            self.max_wait = seconds
+
+    def reset(self):
+        self.__init__()
+
+
+class TimedQueuePool(AsyncAdaptedQueuePool):
+    # The pool has no event before a checkout starts waiting, so the wait is timed
+    # around the queue get itself (including opening an overflow connection); it only
+    # happens when a session actually needs a connection
+    def _do_get(self):
+        started = time.perf_counter()
+        try:
+            return super()._do_get()
+        finally:
+            waited = time.perf_counter() - started
+            pool_stats.record_wait(waited)
+            metrics.observe_pool_wait(waited)
+
+
+def pool_status(engine: AsyncEngine) -> dict:
+    pool = engine.pool
+    status = {
+        "size": None, "checked_in": None, "checked_out": None, "overflow": None
+    }
+    # Only queue pools expose counters, SQLite in-memory/static pools do not
+    if hasattr(pool, "checkedout"):
+        status = {
+            "size": pool.size(),
+            "checked_in": pool.checkedin(),
+            "checked_out": pool.checkedout(),
+            "overflow": pool.overflow()
+        }
+    return status
+
+
+pool_stats = PoolWaitStats()
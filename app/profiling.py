@@ -0,0 +1,319 @@
+import asyncio
+import datetime
+import logging
+import os
+import random
+import sys
+import threading
+import time
+import uuid
+from collections import Counter, OrderedDict
+from contextvars import ContextVar
+from urllib.parse import parse_qsl
+
+from fastapi import HTTPException
+from fastapi.responses import JSONResponse
+from sqlalchemy import event
+from sqlalchemy.ext.asyncio import AsyncEngine
+
+from auth import get_current_user
+from config import PROFILE_INTERVAL, PROFILE_STORE, PROFILE_STORE_SIZE
+from dependencies import require_role
+from models import UserRole
+from plugins import load_backend
+
+
+logger = logging.getLogger(__name__)
+
+PROFILE_HEADER = b"x-profile"
+PROFILE_PARAM = "profile"
+WAITING = "(waiting)"
+
+
+class RequestProfile:
+    # Wall-clock profile of one request: the sampler thread records the request task's
+    # stack every interval, the running stack while the task is on the event loop and
+    # its await chain (ending in WAITING) while it is suspended, so time spent in the
+    # database or a thread pool shows up where it was awaited
+    def __init__(self, method: str, path: str, trigger: str, max_queries: int):
+        self.id = uuid.uuid4().hex
+        self.method = method
+        self.path = path
+        self.trigger = trigger
+        self.max_queries = max_queries
+        self.started_at = datetime.datetime.now()
+        self.status: int | None = None
+        self.duration = 0.0
+        self.stacks: Counter = Counter()
+        self.on_cpu = 0
+        self.queries: list[dict] = []
+        self.query_count = 0
+        self.db_time = 0.0
+        self._started = time.perf_counter()
+        self._task = asyncio.current_task()
+        self._loop = asyncio.get_running_loop()
+        self._thread_id = threading.get_ident()
+
+    def sample(self, frames: dict):
+        task = self._task
+        if task is None:
+            return
+        root = task.get_coro()
+        if asyncio.current_task(self._loop) is task:
+            stack = running_stack(frames.get(self._thread_id), getattr(root, "cr_frame", None))
+            self.on_cpu += 1
+        else:
+            stack = awaiting_stack(root) + [WAITING]
+        if stack:
+            self.stacks[";".join(stack)] += 1
+
+    def record_query(self, statement: str, started: float, elapsed: float):
+        self.query_count += 1
+        self.db_time += elapsed
+        if len(self.queries) < self.max_queries:
+            self.queries.append({
+                "statement": statement,
+                "start_ms": round((started - self._started) * 1000, 3),
+                "duration_ms": round(elapsed * 1000, 3)
+            })
+
+    def finish(self, status: int | None):
+        self.status = status
+        self.duration = time.perf_counter() - self._started
+        self._task = None
+
+    def summary(self) -> dict:
+        return {
+            "id": self.id,
+            "method": self.method,
+            "path": self.path,
+            "status": self.status,
+            "trigger": self.trigger,
+            "started_at": self.started_at,
+            "duration_ms": round(self.duration * 1000, 3),
+            "samples": sum(self.stacks.values()),
+            "on_cpu_samples": self.on_cpu,
+            "queries": self.query_count,
+            "db_ms": round(self.db_time * 1000, 3)
+        }
+
+    def report(self) -> dict:
+        return {**self.summary(), "statements": self.queries}
+
+    def folded(self) -> str:
+        # Collapsed stacks ("root;...;leaf count"), the input of flamegraph.pl,
+        # speedscope and inferno
+        return "".join(f"{stack} {count}\n" for stack, count in self.stacks.most_common())
+
+
+_labels: dict = {}
+
+def frame_label(code) -> str:
+    label = _labels.get(code)
+    if label is None:
+        name = code.co_qualname.replace(";", ":").replace(" ", "_")
+        label = _labels[code] = f"{name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+    return label
+
+def running_stack(frame, root) -> list[str]:
+    stack = []
+    while frame is not None:
+        stack.append(frame_label(frame.f_code))
+        if frame is root:
+            break
+        frame = frame.f_back
+    stack.reverse()
+    return stack
+
+def awaiting_stack(awaitable) -> list[str]:
+    stack = []
+    while awaitable is not None:
+        frame = getattr(awaitable, "cr_frame", None) or getattr(awaitable, "ag_frame", None)
+        if frame is None:
+            break
+        stack.append(frame_label(frame.f_code))
+        awaitable = getattr(awaitable, "cr_await", None) or getattr(awaitable, "ag_await", None)
+    return stack
+
+
+class Sampler:
+    # One daemon thread for every profiled request in the process; it sleeps on an
+    # event while nothing is being profiled
+    def __init__(self, interval: float):
+        self.interval = interval
+        self.active: set[RequestProfile] = set()
+        self._wake = threading.Event()
+        self._thread: threading.Thread | None = None
+        self._lock = threading.Lock()
+
+    def add(self, profile: RequestProfile):
+        with self._lock:
+            self.active.add(profile)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self.run, name="profiler", daemon=True)
+                self._thread.start()
+        self._wake.set()
+
+    def discard(self, profile: RequestProfile):
+        with self._lock:
+            self.active.discard(profile)
+
+    def run(self):
+        while True:
+            with self._lock:
+                profiles = list(self.active)
+            if not profiles:
+                self._wake.wait()
+                self._wake.clear()
+                continue
+            frames = sys._current_frames()
+            for profile in profiles:
+                try:
+                    profile.sample(frames)
+                except Exception:
+                    logger.exception("Profile sample failed")
+            time.sleep(self.interval)
+
+
+class ProfileStore:
+    async def save(self, profile: RequestProfile):
+        raise NotImplementedError
+
+    async def get(self, profile_id: str) -> RequestProfile | None:
+        raise NotImplementedError
+
+    async def recent(self) -> list[RequestProfile]:
+        raise NotImplementedError
+
+
+class InMemoryProfileStore(ProfileStore):
+    def __init__(self, maxsize: int):
+        self.maxsize = maxsize
+        self._profiles: OrderedDict[str, RequestProfile] = OrderedDict()
+
+    async def save(self, profile: RequestProfile):
+        self._profiles[profile.id] = profile
+        while len(self._profiles) > self.maxsize:
+            self._profiles.popitem(last=False)
+
+    async def get(self, profile_id: str) -> RequestProfile | None:
+        return self._profiles.get(profile_id)
+
+    async def recent(self) -> list[RequestProfile]:
+        return list(reversed(self._profiles.values()))
+
+
+current_profile: ContextVar[RequestProfile | None] = ContextVar("current_profile", default=None)
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if current_profile.get() is not None:
+        conn.info.setdefault("profile_start", []).append(time.perf_counter())
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    profile = current_profile.get()
+    if profile is not None:
+        started = conn.info["profile_start"].pop()
+        profile.record_query(statement, started, time.perf_counter() - started)
+
+def _handle_error(context):
+    # Failed statements are recorded too, and must not leave a start time behind
+    conn = context.connection
+    if conn is None or not conn.info.get("profile_start"):
+        return
+    started = conn.info["profile_start"].pop()
+    profile = current_profile.get()
+    if profile is not None:
+        profile.record_query(context.statement or "", started, time.perf_counter() - started)
+
+def instrument_engine(engine: AsyncEngine):
+    # Statements only, parameters may carry credentials
+    event.listen(engine.sync_engine, "before_cursor_execute", _before_cursor_execute)
+    event.listen(engine.sync_engine, "after_cursor_execute", _after_cursor_execute)
+    event.listen(engine.sync_engine, "handle_error", _handle_error)
+
+
+def profile_requested(scope) -> bool:
+    for name, value in scope["headers"]:
+        if name == PROFILE_HEADER:
+            return value not in (b"", b"0", b"false")
+    query_string = scope.get("query_string", b"")
+    if PROFILE_PARAM.encode() not in query_string:
+        return False
+    params = dict(parse_qsl(query_string.decode("latin-1")))
+    return params.get(PROFILE_PARAM, "0") not in ("", "0", "false")
+
+def bearer_token(scope) -> str | None:
+    for name, value in scope["headers"]:
+        if name == b"authorization":
+            scheme, _, token = value.decode("latin-1").partition(" ")
+            if scheme.lower() == "bearer" and token:
+                return token
+    return None
+
+async def check_admin(scope):
+    # Same check as UserAdminDependency, the middleware runs before any dependency
+    token = bearer_token(scope)
+    if token is None:
+        raise HTTPException(status_code=401, detail="Not authenticated")
+    require_role(UserRole.admin)(await get_current_user(token))
+
+
+class ProfilingMiddleware:
+    # Pure ASGI. A request is profiled when an admin asks for it (X-Profile: 1 or
+    # ?profile=1), or at random with probability sample_rate. The profile is stored
+    # and its id returned in X-Profile-Id, see /api/v1/profiles/. Other requests pay
+    # for a header scan and one context variable lookup per SQL statement.
+    def __init__(
+        self, app, store: ProfileStore, sampler: Sampler, sample_rate: float, max_queries: int
+    ):
+        self.app = app
+        self.store = store
+        self.sampler = sampler
+        self.sample_rate = sample_rate
+        self.max_queries = max_queries
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        if profile_requested(scope):
+            try:
+                await check_admin(scope)
+            except HTTPException as err:
+                response = JSONResponse({"detail": err.detail}, err.status_code, err.headers)
+                await response(scope, receive, send)
+                return
+            trigger = "request"
+        elif self.sample_rate and random.random() < self.sample_rate:
+            trigger = "sampled"
+        else:
+            await self.app(scope, receive, send)
+            return
+
+        profile = RequestProfile(scope["method"], scope["path"], trigger, self.max_queries)
+        status = None
+
+        async def send_wrapper(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                if trigger == "request":
+                    message["headers"] = [
+                        *message.get("headers", []), (b"x-profile-id", profile.id.encode())
+                    ]
+            await send(message)
+
+        token = current_profile.set(profile)
+        self.sampler.add(profile)
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            self.sampler.discard(profile)
+            current_profile.reset(token)
+            profile.finish(status)
+            await self.store.save(profile)
+
+
+profile_store = load_backend(PROFILE_STORE, lambda: InMemoryProfileStore(PROFILE_STORE_SIZE))
+sampler = Sampler(PROFILE_INTERVAL)
@@ -0,0 +1,138 @@
+import datetime
+from typing import NamedTuple
+
+from sqlalchemy import delete, exists, func, insert, literal, select, update
+
+from config import MAX_RENTED_BOOKS, RENT_PERIOD_DAYS
+from models import Session, Book, User, book_user
+import similar
+import stats
+
+
+books = Book.__table__
+
+
+class RentalState(NamedTuple):
+    book_title: str | None
+    available_stock: int | None
+    user_name: str | None
+    rented: int
+    has_book: bool
+
+
+def rent_dates() -> tuple[datetime.datetime, datetime.datetime]:
+    now = datetime.datetime.now()
+    return now, now + datetime.timedelta(days=RENT_PERIOD_DAYS)
+
+def same_pair(book_id: int, user_id: int) -> tuple:
+    return book_user.c.book_id == book_id, book_user.c.user_id == user_id
+
+def lock_user(user_id: int):
+    # Postgres: one user's checkouts queue on the user row. Taken in its own statement,
+    # so the conditional UPDATE that follows reads a snapshot from after the lock and
+    # counts the loans a parallel checkout has just committed
+    return select(User.id).where(User.id == user_id).with_for_update()
+
+def take_book(book_id: int, user_id: int):
+    # The stock, user, 5-book limit and duplicate checks are all part of the
+    # UPDATE's WHERE, so concurrent checkouts cannot oversell a title
+    rented = (
+        select(func.count()).select_from(book_user)
+        .where(book_user.c.user_id == user_id)
+        .scalar_subquery()
+    )
+    return (
+        update(books)
+        .where(
+            books.c.id == book_id,
+            books.c.available_stock > 0,
+            exists().where(User.id == user_id),
+            rented < MAX_RENTED_BOOKS,
+            ~exists().where(*same_pair(book_id, user_id))
+        )
+        .values(available_stock=books.c.available_stock - 1)
+        .returning(books.c.id)
+    )
+
+async def rent_book(session: Session, book_id: int, user_id: int) -> bool:
+    rent_date, return_date = rent_dates()
+    columns = ["book_id", "user_id", "rent_date", "return_date"]
+    if session.bind.dialect.name == "postgresql":
+        await session.execute(lock_user(user_id))
+        taken = take_book(book_id, user_id).cte("taken")
+        statement = insert(book_user).from_select(
+            columns,
+            select(taken.c.id, literal(user_id), literal(rent_date), literal(return_date))
+        ).returning(book_user.c.book_id)
+        result = await session.execute(statement)
+        if result.first() is None:
+            return False
+    else:
+        result = await session.execute(take_book(book_id, user_id))
+        if result.first() is None:
+            return False
+        await session.execute(insert(book_user).values(dict(zip(
+            columns, (book_id, user_id, rent_date, return_date)
+        ))))
+    await stats.book_rented(session, book_id)
+    await similar.record_rental(session, book_id, user_id, 1)
+    return True
+
+async def return_book(session: Session, book_id: int, user_id: int) -> bool:
+    removed = delete(book_user).where(*same_pair(book_id, user_id)).returning(book_user.c.book_id)
+    if session.bind.dialect.name == "postgresql":
+        removed = removed.cte("removed")
+        statement = (
+            update(books)
+            .where(books.c.id.in_(select(removed.c.book_id)))
+            .values(available_stock=books.c.available_stock + 1)
+            .returning(books.c.id)
+        )
+        result = await session.execute(statement)
+        if result.first() is None:
+            return False
+    else:
+        result = await session.execute(removed)
+        if result.first() is None:
+            return False
+        await session.execute(
+            update(books)
+            .where(books.c.id == book_id)
+            .values(available_stock=books.c.available_stock + 1)
+        )
+    await stats.book_returned(session, book_id)
+    await similar.record_rental(session, book_id, user_id, -1)
+    return True
+
+async def rental_state(session: Session, book_id: int, user_id: int) -> RentalState:
+    # Only used to explain why a conditional rent/return did not apply
+    book = select(books.c.title, books.c.available_stock).where(books.c.id == book_id).subquery()
+    statement = select(
+        select(book.c.title).scalar_subquery(),
+        select(book.c.available_stock).scalar_subquery(),
+        select(User.name).where(User.id == user_id).scalar_subquery(),
+        select(func.count()).select_from(book_user)
+        .where(book_user.c.user_id == user_id).scalar_subquery(),
+        exists().where(*same_pair(book_id, user_id))
+    )
+    result = await session.execute(statement)
+    return RentalState(*result.one())
+
+def rent_failure(state: RentalState) -> tuple[int, str] | None:
+    if state.book_title is None:
+        return 404, "Book not found"
+    if state.user_name is None:
+        return 404, "User not found"
+    if state.has_book:
+        return 400, f"User {state.user_name} already has book {state.book_title}"
+    if state.rented >= MAX_RENTED_BOOKS:
+        return 400, f"User {state.user_name} has already {MAX_RENTED_BOOKS} books"
+    # Out of stock is reported as a status, not an error
+    return None
+
+def return_failure(state: RentalState) -> tuple[int, str]:
+    if state.book_title is None:
+        return 404, "Book not found"
+    if state.user_name is None:
+        return 404, "User not found"
+    return 404, f"Book {state.book_title} not found in user's books"
@@ -0,0 +1,127 @@
+import asyncio
+import itertools
+import logging
+import time
+
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncEngine, async_sessionmaker
+from starlette.requests import Request
+
+from config import REPLICA_HEALTH_INTERVAL, REPLICA_PIN_SECONDS
+from models import replica_engines
+from periodic import PeriodicTask
+
+
+logger = logging.getLogger(__name__)
+
+PIN_COOKIE = "db_pin"
+# Any client may ask for the primary, e.g. right after a write made elsewhere
+FORCE_PRIMARY_HEADER = "x-db-primary"
+
+
+class Replica:
+    def __init__(self, engine: AsyncEngine):
+        self.engine = engine
+        self.sessionmaker = async_sessionmaker(bind=engine, expire_on_commit=False)
+        self.healthy = True
+
+    @property
+    def name(self) -> str:
+        return self.engine.url.render_as_string(hide_password=True)
+
+
+class ReplicaRouter(PeriodicTask):
+    # Read-only routes ask choose() for a replica; None means "use the primary":
+    # no replicas configured or healthy, the client forced it, or the client wrote
+    # recently and must see its own write (replication lag)
+    name = "Replica health check"
+
+    def __init__(self, engines: list[AsyncEngine], pin_seconds: float, health_interval: float):
+        self.replicas = [Replica(engine) for engine in engines]
+        self.pin_seconds = pin_seconds
+        self.interval = health_interval
+        self._next = itertools.cycle(self.replicas) if self.replicas else None
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.replicas)
+
+    def pinned(self, request: Request) -> bool:
+        if request.headers.get(FORCE_PRIMARY_HEADER, "").lower() in ("1", "true", "yes"):
+            return True
+        try:
+            return float(request.cookies.get(PIN_COOKIE, 0)) > time.time()
+        except ValueError:
+            return False
+
+    def choose(self, request: Request) -> Replica | None:
+        if not self.enabled or self.pinned(request):
+            return None
+        for _ in range(len(self.replicas)):
+            replica = next(self._next)
+            if replica.healthy:
+                return replica
+        return None
+
+    def pin(self, request: Request):
+        # Picked up by ReplicaPinMiddleware once the response starts
+        if self.enabled:
+            request.state.db_pin = time.time() + self.pin_seconds
+
+    def mark_down(self, replica: Replica, err: Exception):
+        if replica.healthy:
+            logger.warning("Replica %s is down, reading from the primary: %s", replica.name, err)
+        replica.healthy = False
+
+    async def check(self, replica: Replica):
+        try:
+            async with replica.engine.connect() as conn:
+                await asyncio.wait_for(conn.execute(text("SELECT 1")), self.interval)
+        except Exception as err:
+            self.mark_down(replica, err)
+            return
+        if not replica.healthy:
+            logger.warning("Replica %s is back", replica.name)
+        replica.healthy = True
+
+    async def tick(self):
+        await asyncio.gather(*(self.check(replica) for replica in self.replicas))
+
+    def start(self):
+        if self.enabled and self.interval > 0:
+            super().start()
+
+    async def stop(self):
+        await super().stop()
+        for replica in self.replicas:
+            await replica.engine.dispose()
+
+
+class ReplicaPinMiddleware:
+    # Pure ASGI: sets the pin cookie for requests that committed a write, so the
+    # same client keeps reading from the primary for REPLICA_PIN_SECONDS
+    def __init__(self, app, pin_seconds: float = REPLICA_PIN_SECONDS):
+        self.app = app
+        self.pin_seconds = pin_seconds
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        state = scope.setdefault("state", {})
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start" and state.get("db_pin"):
+                cookie = (
+                    f"{PIN_COOKIE}={state['db_pin']:.3f}; Max-Age={int(self.pin_seconds) + 1}; "
+                    "Path=/; HttpOnly; SameSite=Lax"
+                )
+                message["headers"] = list(message.get("headers", [])) + [
+                    (b"set-cookie", cookie.encode())
+                ]
+            await send(message)
+
+        await self.app(scope, receive, send_wrapper)
+
+
+replica_router = ReplicaRouter(replica_engines, REPLICA_PIN_SECONDS, REPLICA_HEALTH_INTERVAL)
@@ -0,0 +1,60 @@
+import time
+
+from sqlalchemy import delete, insert, select
+
+from config import REVOCATION_SYNC_INTERVAL
+from models import RevokedToken, engine
+from periodic import PeriodicTask
+from tokens import InMemoryRevocationBackend
+
+
+# Rows are read back by revoked_at, stamped with the revoking worker's clock: the
+# overlap covers clock skew between hosts and inserts that commit after a later
+# stamp has already been read. Applying a row twice is harmless.
+SYNC_OVERLAP = 30
+
+
+class DatabaseRevocationBackend(PeriodicTask, InMemoryRevocationBackend):
+    # Shared through the revoked_tokens table (migration 4). Tokens are still checked
+    # against this worker's in-memory copy, so an authenticated request costs no
+    # query; a revocation is applied here right away and reaches the other workers
+    # with their next sync, within REVOCATION_SYNC_INTERVAL seconds.
+    name = "Revocation sync"
+
+    def __init__(self, sync_interval: float = REVOCATION_SYNC_INTERVAL):
+        InMemoryRevocationBackend.__init__(self)
+        self.interval = sync_interval
+        self.synced_at: float | None = None
+
+    async def record(self, **values):
+        now = time.time()
+        async with engine.begin() as conn:
+            await conn.execute(delete(RevokedToken).where(RevokedToken.expires_at <= now))
+            await conn.execute(insert(RevokedToken).values(revoked_at=now, **values))
+
+    async def revoke_token(self, key: str, expires_at: float):
+        await self.record(token_key=key, expires_at=expires_at)
+        await super().revoke_token(key, expires_at)
+
+    async def revoke_user_tokens(self, user_id: int, issued_before: float, expires_at: float):
+        await self.record(user_id=user_id, issued_before=issued_before, expires_at=expires_at)
+        await super().revoke_user_tokens(user_id, issued_before, expires_at)
+
+    async def tick(self):
+        # The first sync loads every live row, later ones what was revoked since
+        now = time.time()
+        query = select(
+            RevokedToken.token_key, RevokedToken.user_id,
+            RevokedToken.issued_before, RevokedToken.expires_at
+        ).where(RevokedToken.expires_at > now)
+        if self.synced_at is not None:
+            query = query.where(RevokedToken.revoked_at >= self.synced_at - SYNC_OVERLAP)
+        async with engine.connect() as conn:
+            rows = (await conn.execute(query)).all()
+        self.synced_at = now
+        self._purge()
+        for key, user_id, issued_before, expires_at in rows:
+            if key is not None:
+                self._tokens[key] = expires_at
+            else:
+                self._add_user(user_id, issued_before, expires_at)
@@ -1,14 +1,21 @@
 import datetime
-from typing import Literal
+from typing import Any, Generic, Literal, TypeVar
 
 from pydantic import BaseModel, EmailStr, field_validator, Field
 
 
+T = TypeVar("T")
+
+
 class ItemId(BaseModel):
     id: int
 
 class StatusResponse(BaseModel):
-    status: Literal["ok", "deleted"]
+    status: Literal["ok", "deleted", "book not available"]
+
+class Page(BaseModel, Generic[T]):
+    items: list[T]
+    next_cursor: str | None = None
 
 class BaseUser(BaseModel):
     email: EmailStr
@@ -81,6 +88,145 @@ class AddBook(BaseModel):
     genres: list[int]
     available_stock: int
 
+class RentalAction(BaseModel):
+    action: Literal["rent", "return"]
+    book_id: int
+    user_id: int
+
+class RentalResult(RentalAction):
+    status: Literal["ok", "book not available", "error"]
+    detail: str | None = None
+
+class BatchOperation(BaseModel):
+    id: str | None = None
+    op: str
+    params: dict[str, Any] = {}
+    body: dict[str, Any] | None = None
+
+class BatchRequest(BaseModel):
+    mode: Literal["atomic", "independent"] = "atomic"
+    operations: list[BatchOperation]
+
+class BatchResult(BaseModel):
+    id: str | None
+    op: str
+    status: int
+    body: Any = None
+
+class HealthStatus(BaseModel):
+    status: Literal["ok", "degraded"]
+    schema_version: int | None
+    expected_schema_version: int
+    detail: str | None = None
+
+class CacheStats(BaseModel):
+    hits: int
+    misses: int
+    not_modified: int
+    stale_skips: int
+    invalidations: int
+    size: int
+
+class PoolStats(BaseModel):
+    size: int | None
+    checked_in: int | None
+    checked_out: int | None
+    overflow: int | None
+    checkouts: int
+    total_wait: float
+    avg_wait: float
+    max_wait: float
+
+class OverdueLoan(BaseModel):
+    book_id: int
+    title: str
+    user_id: int
+    user_name: str
+    email: str
+    rent_date: datetime.datetime
+    return_date: datetime.datetime
+
+class SimilarBook(BaseModel):
+    id: int
+    title: str
+    score: float
+    source: Literal["co-rental", "catalog"]
+
+class BookSuggestion(BaseModel):
+    id: int
+    title: str
+
+class AuthorSuggestion(BaseModel):
+    id: int
+    name: str
+
+class Suggestions(BaseModel):
+    books: list[BookSuggestion]
+    authors: list[AuthorSuggestion]
+
+class SuggestStats(BaseModel):
+    built: bool
+    books: int
+    authors: int
+    keys: int
+    bytes: int
+
+class SimilarStats(BaseModel):
+    built: bool
+    co_rental_pairs: int
+    overlay_books: int
+    array_bytes: int
+
+class ProfileSummary(BaseModel):
+    id: str
+    method: str
+    path: str
+    status: int | None
+    trigger: Literal["request", "sampled"]
+    started_at: datetime.datetime
+    duration_ms: float
+    samples: int
+    on_cpu_samples: int
+    queries: int
+    db_ms: float
+
+class ProfiledQuery(BaseModel):
+    statement: str
+    start_ms: float
+    duration_ms: float
+
+class ProfileReport(ProfileSummary):
+    statements: list[ProfiledQuery]
+
+class CatalogStats(BaseModel):
+    books: int
+    available_stock: int
+    rented: int
+    total_stock: int
+
+class GenreCount(BaseModel):
+    id: int
+    name: str
+    books: int
+
+class AuthorCount(BaseModel):
+    id: int
+    name: str
+    books: int
+
+class BookRentals(BaseModel):
+    id: int
+    title: str
+    rentals: int
+
+class ImportRowError(BaseModel):
+    line: int
+    detail: str
+
+class ImportReport(BaseModel):
+    imported: int
+    errors: list[ImportRowError]
+
 class GetBook(BaseModel):
     id: int
     title: str
@@ -0,0 +1,46 @@
+import re
+
+from sqlalchemy import Select, column, func, literal, literal_column, or_, table, text
+
+from models import Book, book_search_vector
+from pagination import SortKey
+
+
+books_fts = table("books_fts", column("rowid"), column("rank"))
+
+
+def search_terms(value: str) -> list[str]:
+    return re.findall(r"\w+", value.lower())
+
+def text_match(column, value: str, dialect: str):
+    # On Postgres both ILIKE and the similarity operator are served by the trigram GIN index
+    substring = column.icontains(value, autoescape=True)
+    if dialect == "postgresql":
+        return or_(substring, column.op("%")(literal(value)))
+    return substring
+
+def full_text_search(query: Select, value: str, dialect: str) -> tuple[Select, list[SortKey]]:
+    terms = search_terms(value)
+    if not terms:
+        return query.where(literal(False)), [SortKey("id", Book.id)]
+    if dialect == "postgresql":
+        ts_query = func.to_tsquery(
+            text("'simple'::regconfig"),
+            " & ".join(f"{term}:*" for term in terms)
+        )
+        vector = book_search_vector()
+        rank = func.ts_rank(vector, ts_query)
+        query = query.where(vector.op("@@")(ts_query))
+    elif dialect == "sqlite":
+        match = " ".join(f'"{term}"*' for term in terms)
+        # FTS5 rank is bm25, lower is better
+        rank = -books_fts.c.rank
+        query = (
+            query.join(books_fts, books_fts.c.rowid == Book.id)
+            .where(literal_column("books_fts").op("MATCH")(match))
+        )
+    else:
+        query = query.where(*(Book.title.icontains(term, autoescape=True) for term in terms))
+        return query, [SortKey("id", Book.id)]
+    query = query.add_columns(rank.label("rank"))
+    return query, [SortKey("rank", rank, float, descending=True), SortKey("id", Book.id)]
@@ -0,0 +1,110 @@
+import datetime
+from typing import Any, Callable
+
+import orjson
+from fastapi import Response
+
+
+# Response encoders write what the response_model would produce, field for field and
+# in schema order, straight from ORM objects or result rows (anything with the
+# attributes), skipping pydantic validation of data that came out of our own database.
+# The routes keep their response_model so the OpenAPI schema is unchanged.
+
+Encoder = Callable[[Any], Any]
+
+
+def as_date(value: datetime.date) -> datetime.date:
+    # DateTime column behind a date field, pydantic would truncate a midnight datetime
+    if isinstance(value, datetime.datetime):
+        return value.date()
+    return value
+
+def name_record(item) -> dict:
+    # BaseAuthor and GenreSchema
+    return {"name": item.name}
+
+def author_record(author) -> dict:
+    return {
+        "name": author.name,
+        "biography": author.biography,
+        "date_of_birth": as_date(author.date_of_birth),
+        "id": author.id
+    }
+
+def book_record(book) -> dict:
+    return {
+        "id": book.id,
+        "title": book.title,
+        "description": book.description,
+        "release_year": book.release_year,
+        "authors": [{"name": author.name} for author in book.authors],
+        "genres": [{"name": genre.name} for genre in book.genres],
+        "available_stock": book.available_stock
+    }
+
+def user_record(user) -> dict:
+    return {
+        "id": user.id,
+        "name": user.name,
+        "email": user.email,
+        "role": user.role
+    }
+
+def user_details_record(user) -> dict:
+    record = user_record(user)
+    record["books"] = [book_record(book) for book in user.books]
+    return record
+
+def fieldset_record(fieldset) -> Encoder:
+    # Sparse fieldsets (fieldsets.FieldSet): only the selected attributes are read,
+    # in schema order, the unselected ones were never loaded
+    nested = {name: fieldset_record(value) for name, value in fieldset.nested.items()}
+
+    def encode(item) -> dict:
+        return {
+            field: [nested[field](value) for value in getattr(item, field)]
+            if field in nested else getattr(item, field)
+            for field in fieldset.fields
+        }
+    return encode
+
+def genre_count_record(counter) -> dict:
+    return {"id": counter.genre_id, "name": counter.genre.name, "books": counter.books}
+
+def author_count_record(counter) -> dict:
+    return {"id": counter.author_id, "name": counter.author.name, "books": counter.books}
+
+def book_rentals_record(counter) -> dict:
+    return {"id": counter.book_id, "title": counter.book.title, "rentals": counter.rentals}
+
+def overdue_record(loan) -> dict:
+    return {
+        "book_id": loan.book_id,
+        "title": loan.title,
+        "user_id": loan.user_id,
+        "user_name": loan.user_name,
+        "email": loan.email,
+        "rent_date": loan.rent_date,
+        "return_date": loan.return_date
+    }
+
+def suggestions_record(suggestions: dict) -> dict:
+    return {
+        "books": [{"id": i, "title": title} for i, title in suggestions["books"]],
+        "authors": [{"id": i, "name": name} for i, name in suggestions["authors"]]
+    }
+
+def page_record(page: dict, encode: Encoder) -> dict:
+    return {
+        "items": [encode(item) for item in page["items"]],
+        "next_cursor": page["next_cursor"]
+    }
+
+def dump(data: Any) -> bytes:
+    return orjson.dumps(data)
+
+def json_response(item: Any, encode: Encoder) -> Response:
+    return Response(content=dump(encode(item)), media_type="application/json")
+
+def page_encoder(encode: Encoder) -> Encoder:
+    return lambda page: page_record(page, encode)
@@ -0,0 +1,217 @@
+"""Production launcher: one preloaded parent, N forked uvicorn workers on a shared socket.
+
+    python serve.py --host 0.0.0.0 --port 80 --workers 4
+
+The parent sizes the per-worker settings, imports the app once, applies migrations when
+asked to (--migrate) and checks the schema version, then forks. Workers inherit the imported
+code (copy-on-write), the schema state and the listening socket, start without waiting for
+the database and drain in-flight requests on SIGTERM.
+Dead workers are replaced until the parent itself is asked to stop.
+
+Token revocation, the response cache and the auth rate limits keep their state in the
+process unless a shared backend is configured. A token revoked in one worker must be
+rejected by all of them, so more than one worker requires REVOCATION_BACKEND
+(revocation:DatabaseRevocationBackend ships with the app); without it the default is a
+single worker, with it one worker per core. Without RESPONSE_CACHE_BACKEND each worker
+caches on its own and only drops its own entries on writes, so other workers may serve
+a stale response for up to RESPONSE_CACHE_TTL; without RATE_LIMIT_BACKEND every worker
+counts separately and a client gets up to --workers times the auth rate limits.
+/metrics and stored profiles stay per worker either way.
+
+Client addresses come from X-Forwarded-For only when the peer is listed in uvicorn's
+FORWARDED_ALLOW_IPS (127.0.0.1 by default): behind a load balancer set it to the
+balancer's addresses, the per-IP login limits (AUTH_IP_RATE) depend on it.
+"""
+import argparse
+import asyncio
+import os
+import signal
+import socket
+import sys
+import time
+import traceback
+
+# Per-process state that forked workers would each keep a diverging copy of: revocation
+# must be shared, the cache and the rate limits degrade to per-worker state
+SHARED_BACKENDS = ("REVOCATION_BACKEND", "RESPONSE_CACHE_BACKEND", "RATE_LIMIT_BACKEND")
+REQUIRED_BACKENDS = ("REVOCATION_BACKEND",)
+
+
+def available_cores() -> int:
+    # Respects CPU affinity / container cpusets where the platform exposes them
+    if hasattr(os, "sched_getaffinity"):
+        return len(os.sched_getaffinity(0))
+    return os.cpu_count() or 1
+
+def missing_backends() -> list[str]:
+    return [name for name in SHARED_BACKENDS if not os.getenv(name)]
+
+def default_workers() -> int:
+    if set(missing_backends()) & set(REQUIRED_BACKENDS):
+        return 1
+    return available_cores()
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default=os.getenv("HOST", "0.0.0.0"))
+    parser.add_argument("--port", type=int, default=int(os.getenv("PORT", "80")))
+    parser.add_argument(
+        "--workers", type=int, default=int(os.getenv("WEB_CONCURRENCY", default_workers())),
+        help="worker processes, the number of available cores by default when "
+             "REVOCATION_BACKEND is configured, otherwise 1"
+    )
+    parser.add_argument(
+        "--db-connections", type=int,
+        default=int(os.getenv("DB_MAX_CONNECTIONS", "0")) or None,
+        help="connection budget per database shared by all workers "
+             "(default: DB_POOL_SIZE + DB_MAX_OVERFLOW)"
+    )
+    parser.add_argument(
+        "--graceful-timeout", type=float, default=float(os.getenv("GRACEFUL_TIMEOUT", "30")),
+        help="seconds a worker waits for in-flight requests on shutdown"
+    )
+    parser.add_argument("--backlog", type=int, default=2048)
+    parser.add_argument(
+        "--migrate", action="store_true",
+        help="apply pending migrations in the parent before starting workers"
+    )
+    return parser.parse_args(argv)
+
+def configure(args):
+    # Settings are read at import time, so the split happens before the app is imported.
+    # Each worker gets an equal share of the connection budget with no overflow, the
+    # total never exceeds what the database was sized for.
+    budget = args.db_connections or (
+        int(os.getenv("DB_POOL_SIZE", "10")) + int(os.getenv("DB_MAX_OVERFLOW", "10"))
+    )
+    os.environ["DB_POOL_SIZE"] = str(max(1, budget // args.workers))
+    os.environ["DB_MAX_OVERFLOW"] = "0"
+    os.environ.setdefault("HASH_WORKERS", str(max(1, available_cores() // args.workers)))
+    os.environ["DB_STARTUP"] = "lazy"
+
+def bind(host: str, port: int, backlog: int) -> socket.socket:
+    family = socket.AF_INET6 if ":" in host else socket.AF_INET
+    sock = socket.socket(family, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, port))
+    sock.listen(backlog)
+    sock.set_inheritable(True)
+    return sock
+
+
+class Supervisor:
+    def __init__(self, app, sock: socket.socket, workers: int, graceful_timeout: float):
+        self.app = app
+        self.sock = sock
+        self.workers = workers
+        self.graceful_timeout = graceful_timeout
+        self.children: dict[int, int] = {}
+        self.stopping = False
+
+    def spawn(self, index: int):
+        pid = os.fork()
+        if pid:
+            self.children[pid] = index
+            return
+        # Own process group: a terminal's Ctrl+C reaches the parent only, which then
+        # stops the workers once instead of each getting SIGINT and SIGTERM
+        os.setpgid(0, 0)
+        for signum in (signal.SIGTERM, signal.SIGINT):
+            signal.signal(signum, signal.SIG_DFL)
+        try:
+            self.serve(index)
+        except BaseException:
+            traceback.print_exc()
+            os._exit(1)
+        os._exit(0)
+
+    def serve(self, index: int):
+        import uvicorn
+        from overdue import overdue_scanner
+
+        # Background jobs that scan the whole database run in one worker only
+        if index != 0:
+            overdue_scanner.interval = 0
+        config = uvicorn.Config(
+            self.app,
+            lifespan="on",
+            proxy_headers=True,
+            timeout_graceful_shutdown=self.graceful_timeout
+        )
+        uvicorn.Server(config).run(sockets=[self.sock])
+
+    def stop(self, signum, frame):
+        self.stopping = True
+        for pid in self.children:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    def run(self):
+        signal.signal(signal.SIGTERM, self.stop)
+        signal.signal(signal.SIGINT, self.stop)
+        for index in range(self.workers):
+            self.spawn(index)
+        while self.children:
+            try:
+                pid, status = os.wait()
+            except ChildProcessError:
+                break
+            except InterruptedError:
+                continue
+            index = self.children.pop(pid, None)
+            if index is None or self.stopping:
+                continue
+            print(f"Worker {pid} exited with status {status}, restarting", file=sys.stderr)
+            # Do not spin if a worker dies right away
+            time.sleep(1)
+            self.spawn(index)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    if args.workers < 1:
+        raise SystemExit("--workers must be at least 1")
+    missing = missing_backends()
+    required = [name for name in missing if name in REQUIRED_BACKENDS]
+    if args.workers > 1 and required:
+        raise SystemExit(
+            f"--workers {args.workers} needs a shared token revocation list, set "
+            f"{', '.join(required)} (e.g. revocation:DatabaseRevocationBackend): a token "
+            "revoked in one worker would otherwise stay valid in the others"
+        )
+    if args.workers > 1 and missing:
+        print(
+            f"{', '.join(missing)} not set, the response cache and the auth rate limits "
+            "are kept per worker",
+            file=sys.stderr
+        )
+    configure(args)
+
+    # Preload: everything is imported once here and shared with the workers
+    from app import app
+    from migrations import migrate, schema_state
+    from models import engine, replica_engines
+
+    async def prepare():
+        if args.migrate:
+            await migrate(engine)
+        await schema_state.check(engine)
+        # No pooled connection may cross the fork
+        await engine.dispose()
+        for replica_engine in replica_engines:
+            await replica_engine.dispose()
+
+    asyncio.run(prepare())
+    sock = bind(args.host, args.port, args.backlog)
+    print(
+        f"Serving on {args.host}:{args.port} with {args.workers} workers, "
+        f"{os.environ['DB_POOL_SIZE']} DB connections each",
+        file=sys.stderr
+    )
+    Supervisor(app, sock, args.workers, args.graceful_timeout).run()
+
+
+if __name__ == "__main__":
+    main()
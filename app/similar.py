@@ -0,0 +1,207 @@
+import bisect
+import heapq
+import time
+from array import array
+from collections import Counter, defaultdict
+from itertools import combinations
+from typing import Iterable, NamedTuple
+
+from sqlalchemy import select
+
+from config import SIMILAR_FALLBACK_SCAN, SIMILAR_REFRESH_INTERVAL
+from crud import on_commit
+from models import Session, book_author, book_genre, book_user
+from periodic import PeriodicTask
+
+
+class Csr(NamedTuple):
+    # Compressed sparse rows keyed by id: row i belongs to keys[i] and spans
+    # values[indptr[i]:indptr[i + 1]] (and weights, when present)
+    keys: array
+    indptr: array
+    values: array
+    weights: array | None
+
+    @classmethod
+    def build(cls, rows: dict[int, Iterable], weighted: bool = False) -> "Csr":
+        keys, indptr = array("q"), array("q", [0])
+        values, weights = array("q"), array("q") if weighted else None
+        for key in sorted(rows):
+            row = rows[key]
+            if weighted:
+                # Heaviest first, a top-k read is a slice
+                for value, weight in sorted(row.items(), key=lambda item: (-item[1], item[0])):
+                    values.append(value)
+                    weights.append(weight)
+            else:
+                values.extend(sorted(row))
+            keys.append(key)
+            indptr.append(len(values))
+        return cls(keys, indptr, values, weights)
+
+    def span(self, key: int) -> tuple[int, int]:
+        i = bisect.bisect_left(self.keys, key)
+        if i == len(self.keys) or self.keys[i] != key:
+            return 0, 0
+        return self.indptr[i], self.indptr[i + 1]
+
+    def row(self, key: int) -> array:
+        start, end = self.span(key)
+        return self.values[start:end]
+
+    def weighted_row(self, key: int) -> list[tuple[int, int]]:
+        start, end = self.span(key)
+        return list(zip(self.values[start:end], self.weights[start:end]))
+
+    @property
+    def nbytes(self) -> int:
+        arrays = [self.keys, self.indptr, self.values] + ([self.weights] if self.weights else [])
+        return sum(len(a) * a.itemsize for a in arrays)
+
+
+EMPTY = Csr.build({})
+
+
+class SimilarBooks(PeriodicTask):
+    # "Readers also borrowed": co-rental counts are how many readers hold both books
+    # at once, from book_user. The background job rebuilds the matrix from a snapshot,
+    # rent/return events adjust an overlay in between. Books with too few co-rentals
+    # are topped up from genre/author overlap, scored from the same kind of arrays.
+    name = "Similar books rebuild"
+
+    def __init__(self, refresh_interval: float, fallback_scan: int):
+        self.interval = refresh_interval
+        self.fallback_scan = fallback_scan
+        self.co_rentals = EMPTY
+        self.book_genres = self.book_authors = EMPTY
+        self.genre_books = self.author_books = EMPTY
+        self.overlay: defaultdict[int, Counter] = defaultdict(Counter)
+        self.built = False
+        self._pending: list[tuple[float, int, list[int], int]] | None = None
+
+    # Model building
+
+    async def rebuild(self):
+        # Events keep adjusting the current overlay while the snapshot is read and are
+        # also logged with their commit time. The new overlay replays only the ones
+        # that committed after the snapshot marker, the others are in the snapshot.
+        # The marker is taken on an open connection right before the statement, the
+        # callback of a commit that lands just before it may still run after it.
+        pairs: defaultdict[int, Counter] = defaultdict(Counter)
+        links = {"genre": defaultdict(set), "author": defaultdict(set)}
+        self._pending = []
+        try:
+            async with Session() as session:
+                await session.connection()
+                holdings = defaultdict(list)
+                snapshot_at = time.monotonic()
+                rows = await session.stream(select(book_user.c.user_id, book_user.c.book_id))
+                async for user_id, book_id in rows:
+                    holdings[user_id].append(book_id)
+                for table, kind in ((book_genre, "genre"), (book_author, "author")):
+                    rows = await session.stream(select(table.c.book_id, table.c[f"{kind}_id"]))
+                    async for book_id, item_id in rows:
+                        links[kind][book_id].add(item_id)
+            overlay: defaultdict[int, Counter] = defaultdict(Counter)
+            for committed_at, book_id, others, delta in self._pending:
+                if committed_at > snapshot_at:
+                    add_rental(overlay, book_id, others, delta)
+        finally:
+            self._pending = None
+        for books in holdings.values():
+            for a, b in combinations(books, 2):
+                pairs[a][b] += 1
+                pairs[b][a] += 1
+        self.co_rentals, self.overlay = Csr.build(pairs, weighted=True), overlay
+        self.book_genres, self.genre_books = Csr.build(links["genre"]), invert(links["genre"])
+        self.book_authors, self.author_books = Csr.build(links["author"]), invert(links["author"])
+        self.built = True
+
+    async def apply_rental(self, book_id: int, others: list[int], delta: int):
+        # Runs once the rental's transaction has committed
+        if self._pending is not None:
+            self._pending.append((time.monotonic(), book_id, others, delta))
+        add_rental(self.overlay, book_id, others, delta)
+
+    # Lookups
+
+    def co_rented(self, book_id: int, limit: int) -> list[tuple[int, float]]:
+        delta = self.overlay.get(book_id)
+        if not delta:
+            return [(other, float(count)) for other, count in self.co_rentals.weighted_row(book_id)[:limit]]
+        counts = Counter(dict(self.co_rentals.weighted_row(book_id)))
+        counts.update(delta)
+        best = heapq.nsmallest(
+            limit, ((-count, other) for other, count in counts.items() if count > 0)
+        )
+        return [(other, float(-count)) for count, other in best]
+
+    def catalog_overlap(self, book_id: int, limit: int, exclude: set[int]) -> list[tuple[int, float]]:
+        # Shared author counts double a shared genre; each inverted list is scanned up
+        # to fallback_scan entries so a huge genre cannot make a lookup expensive
+        scores = Counter()
+        for weight, own, inverted in (
+            (2.0, self.book_authors, self.author_books),
+            (1.0, self.book_genres, self.genre_books)
+        ):
+            for item_id in own.row(book_id):
+                for other in inverted.row(item_id)[:self.fallback_scan]:
+                    scores[other] += weight
+        scores.pop(book_id, None)
+        best = heapq.nsmallest(
+            limit, ((-score, other) for other, score in scores.items() if other not in exclude)
+        )
+        return [(other, -score) for score, other in best]
+
+    def similar(self, book_id: int, limit: int) -> list[tuple[int, float, str]]:
+        results = [(other, score, "co-rental") for other, score in self.co_rented(book_id, limit)]
+        if len(results) < limit:
+            seen = {other for other, _, _ in results}
+            results += [
+                (other, score, "catalog")
+                for other, score in self.catalog_overlap(book_id, limit - len(results), seen)
+            ]
+        return results
+
+    def stats(self) -> dict:
+        structures = (
+            self.co_rentals, self.book_genres, self.genre_books, self.book_authors, self.author_books
+        )
+        return {
+            "built": self.built,
+            "co_rental_pairs": len(self.co_rentals.values),
+            "overlay_books": len(self.overlay),
+            "array_bytes": sum(csr.nbytes for csr in structures)
+        }
+
+    # Background job
+
+    async def tick(self):
+        await self.rebuild()
+
+
+def add_rental(overlay: defaultdict[int, Counter], book_id: int, others: list[int], delta: int):
+    for other in others:
+        overlay[book_id][other] += delta
+        overlay[other][book_id] += delta
+
+def invert(links: dict[int, set[int]]) -> Csr:
+    inverted = defaultdict(set)
+    for book_id, item_ids in links.items():
+        for item_id in item_ids:
+            inverted[item_id].add(book_id)
+    return Csr.build(inverted)
+
+async def record_rental(session: Session, book_id: int, user_id: int, delta: int):
+    # Rent (+1) or return (-1): the co-holding with the reader's other books changes,
+    # applied to the model once the transaction commits
+    others = await session.scalars(
+        select(book_user.c.book_id)
+        .where(book_user.c.user_id == user_id, book_user.c.book_id != book_id)
+    )
+    others = list(others)
+    if others:
+        on_commit(session, similar_books.apply_rental, book_id, others, delta)
+
+
+similar_books = SimilarBooks(SIMILAR_REFRESH_INTERVAL, SIMILAR_FALLBACK_SCAN)
@@ -0,0 +1,132 @@
+import random
+from collections import Counter
+from typing import Iterable
+
+from sqlalchemy import delete, func, select
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.orm import joinedload
+
+from config import STATS_SLOTS
+from models import (
+    Session, AuthorCounter, Book, BookRentalCounter, CatalogCounter, GenreCounter,
+    book_author, book_genre
+)
+from pagination import Pagination, SortKey
+from crud import paginate
+
+
+# Summary tables are adjusted inside the same transaction as the write that changes
+# the underlying data, with atomic "col = col + delta" upserts, so they are exactly as
+# consistent as the catalog itself and a rollback undoes both.
+
+def upsert(session: Session, table, key: str, rows: list[dict]):
+    dialect = postgresql if session.bind.dialect.name == "postgresql" else sqlite
+    statement = dialect.insert(table).values(rows)
+    counters = [column for column in rows[0] if column != key]
+    return statement.on_conflict_do_update(
+        index_elements=[key],
+        set_={column: table.c[column] + statement.excluded[column] for column in counters}
+    )
+
+async def adjust_catalog(session: Session, books: int = 0, available_stock: int = 0, rented: int = 0):
+    if not (books or available_stock or rented):
+        return
+    row = {
+        "slot": random.randrange(STATS_SLOTS),
+        "books": books,
+        "available_stock": available_stock,
+        "rented": rented
+    }
+    await session.execute(upsert(session, CatalogCounter.__table__, "slot", [row]))
+
+async def adjust_links(session: Session, counter, key: str, deltas: Counter | None):
+    if not deltas:
+        return
+    # Sorted so concurrent transactions lock the counter rows in the same order
+    rows = [{key: item_id, "books": delta} for item_id, delta in sorted(deltas.items()) if delta]
+    if rows:
+        await session.execute(upsert(session, counter.__table__, key, rows))
+
+async def adjust_books(
+    session: Session,
+    books: int = 0,
+    available_stock: int = 0,
+    authors: Counter | None = None,
+    genres: Counter | None = None
+):
+    await adjust_catalog(session, books=books, available_stock=available_stock)
+    await adjust_links(session, AuthorCounter, "author_id", authors)
+    await adjust_links(session, GenreCounter, "genre_id", genres)
+
+def link_changes(old_ids: Iterable[int], new_ids: Iterable[int]) -> Counter:
+    changes = Counter(set(new_ids))
+    changes.subtract(Counter(set(old_ids)))
+    return changes
+
+# Write path hooks
+
+async def book_created(session: Session, book: Book):
+    await adjust_books(
+        session, books=1, available_stock=book.available_stock,
+        authors=Counter({author.id for author in book.authors}),
+        genres=Counter({genre.id for genre in book.genres})
+    )
+
+async def book_deleted(session: Session, book_id: int, available_stock: int):
+    # Called before the delete, while the link rows still exist
+    authors = await session.scalars(
+        select(book_author.c.author_id).where(book_author.c.book_id == book_id)
+    )
+    genres = await session.scalars(
+        select(book_genre.c.genre_id).where(book_genre.c.book_id == book_id)
+    )
+    await adjust_books(
+        session, books=-1, available_stock=-available_stock,
+        authors=link_changes(authors, ()), genres=link_changes(genres, ())
+    )
+    await session.execute(delete(BookRentalCounter).where(BookRentalCounter.book_id == book_id))
+
+async def book_rented(session: Session, book_id: int):
+    await adjust_catalog(session, available_stock=-1, rented=1)
+    await session.execute(upsert(
+        session, BookRentalCounter.__table__, "book_id", [{"book_id": book_id, "rentals": 1}]
+    ))
+
+async def book_returned(session: Session, book_id: int):
+    await adjust_catalog(session, available_stock=1, rented=-1)
+
+# Reads, each one an index lookup or a scan of STATS_SLOTS rows
+
+async def catalog_totals(session: Session) -> dict:
+    result = await session.execute(select(
+        func.coalesce(func.sum(CatalogCounter.books), 0),
+        func.coalesce(func.sum(CatalogCounter.available_stock), 0),
+        func.coalesce(func.sum(CatalogCounter.rented), 0)
+    ))
+    books, available_stock, rented = result.one()
+    return {
+        "books": books,
+        "available_stock": available_stock,
+        "rented": rented,
+        "total_stock": available_stock + rented
+    }
+
+async def genre_counts(session: Session, pagination: Pagination) -> dict:
+    query = select(GenreCounter).options(joinedload(GenreCounter.genre, innerjoin=True))
+    keys = [SortKey("genre_id", GenreCounter.genre_id)]
+    return await paginate(session, query, pagination, keys)
+
+async def author_counts(session: Session, pagination: Pagination) -> dict:
+    query = select(AuthorCounter).options(joinedload(AuthorCounter.author, innerjoin=True))
+    keys = [SortKey("author_id", AuthorCounter.author_id)]
+    return await paginate(session, query, pagination, keys)
+
+async def most_rented(session: Session, limit: int) -> list[BookRentalCounter]:
+    query = (
+        select(BookRentalCounter)
+        .options(joinedload(BookRentalCounter.book, innerjoin=True))
+        .where(BookRentalCounter.rentals > 0)
+        .order_by(BookRentalCounter.rentals.desc(), BookRentalCounter.book_id)
+        .limit(limit)
+    )
+    return list(await session.scalars(query))
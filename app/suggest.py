@@ -0,0 +1,193 @@
+import bisect
+import logging
+import re
+import sys
+from array import array
+
+from sqlalchemy import select
+
+from config import SUGGEST_KEY_LENGTH, SUGGEST_REFRESH_INTERVAL
+from models import Session, Author, Book
+from periodic import PeriodicTask
+
+
+logger = logging.getLogger(__name__)
+
+WORD = re.compile(r"\w+")
+
+
+def normalize(text: str) -> str:
+    return " ".join(WORD.findall(text.casefold()))
+
+def index_keys(label: str, max_length: int) -> set[str]:
+    # Every word start is a key, so "lord of" and "rings" both find
+    # "The Lord of the Rings"; keys are cut to bound memory for long titles
+    words = WORD.findall(label.casefold())
+    return {" ".join(words[i:])[:max_length] for i in range(len(words))}
+
+
+class PrefixIndex:
+    # Sorted keys with a parallel id array: a prefix lookup is one bisect and a short
+    # forward scan. Edits insert/delete in place (a memmove of pointers, fine for
+    # single-row writes); bulk loads go through build().
+    def __init__(self, max_key_length: int):
+        self.max_key_length = max_key_length
+        self.keys: list[str] = []
+        self.ids = array("q")
+        self.labels: dict[int, str] = {}
+        self.text_bytes = 0
+
+    @classmethod
+    def build(cls, labels: dict[int, str], max_key_length: int) -> "PrefixIndex":
+        index = cls(max_key_length)
+        entries = sorted(
+            (key, item_id) for item_id, label in labels.items()
+            for key in index_keys(label, max_key_length)
+        )
+        index.keys = [key for key, _ in entries]
+        index.ids = array("q", (item_id for _, item_id in entries))
+        index.labels = labels
+        index.text_bytes = (
+            sum(map(sys.getsizeof, index.keys)) + sum(map(sys.getsizeof, labels.values()))
+        )
+        return index
+
+    def add(self, item_id: int, label: str):
+        self.remove(item_id)
+        self.labels[item_id] = label
+        self.text_bytes += sys.getsizeof(label)
+        for key in index_keys(label, self.max_key_length):
+            i = bisect.bisect_right(self.keys, key)
+            self.keys.insert(i, key)
+            self.ids.insert(i, item_id)
+            self.text_bytes += sys.getsizeof(key)
+
+    def remove(self, item_id: int):
+        label = self.labels.pop(item_id, None)
+        if label is None:
+            return
+        self.text_bytes -= sys.getsizeof(label)
+        for key in index_keys(label, self.max_key_length):
+            i = bisect.bisect_left(self.keys, key)
+            while i < len(self.keys) and self.keys[i] == key:
+                if self.ids[i] == item_id:
+                    del self.keys[i]
+                    del self.ids[i]
+                    self.text_bytes -= sys.getsizeof(key)
+                    break
+                i += 1
+
+    def search(self, prefix: str, limit: int) -> list[tuple[int, str]]:
+        prefix = normalize(prefix)[:self.max_key_length]
+        if not prefix:
+            return []
+        found = {}
+        i = bisect.bisect_left(self.keys, prefix)
+        while i < len(self.keys) and len(found) < limit and self.keys[i].startswith(prefix):
+            found.setdefault(self.ids[i])
+            i += 1
+        return [(item_id, self.labels[item_id]) for item_id in found]
+
+    @property
+    def nbytes(self) -> int:
+        return (
+            sys.getsizeof(self.keys) + len(self.ids) * self.ids.itemsize
+            + sys.getsizeof(self.labels) + self.text_bytes
+        )
+
+
+class SuggestIndex(PeriodicTask):
+    # Search-as-you-type over book titles and author names. The background job loads
+    # both from the database at startup (and every interval seconds, so other workers'
+    # writes show up); this worker's writes are applied as soon as they commit.
+    name = "Suggest index rebuild"
+
+    def __init__(self, refresh_interval: float, max_key_length: int):
+        self.interval = refresh_interval
+        self.max_key_length = max_key_length
+        self.books = PrefixIndex(max_key_length)
+        self.authors = PrefixIndex(max_key_length)
+        self.built = False
+        self._pending: list[tuple[str, int, str | None]] | None = None
+
+    async def rebuild(self):
+        # Changes that commit while the snapshot is read are replayed on top of it,
+        # they are idempotent so the ones already in the snapshot do no harm
+        self._pending = []
+        try:
+            labels = {"books": {}, "authors": {}}
+            async with Session() as session:
+                for name, columns in (("books", (Book.id, Book.title)), ("authors", (Author.id, Author.name))):
+                    rows = await session.stream(select(*columns))
+                    async for item_id, label in rows:
+                        labels[name][item_id] = label
+            self.books = PrefixIndex.build(labels["books"], self.max_key_length)
+            self.authors = PrefixIndex.build(labels["authors"], self.max_key_length)
+            for name, item_id, label in self._pending:
+                self._update(name, item_id, label)
+        finally:
+            self._pending = None
+        self.built = True
+        logger.info(
+            "Suggest index built: %d books, %d authors, %d bytes",
+            len(self.books.labels), len(self.authors.labels), self.nbytes
+        )
+
+    def _update(self, name: str, item_id: int, label: str | None):
+        index = getattr(self, name)
+        if label is None:
+            index.remove(item_id)
+        else:
+            index.add(item_id, label)
+
+    def apply(self, name: str, item_id: int, label: str | None):
+        if self._pending is not None:
+            self._pending.append((name, item_id, label))
+        self._update(name, item_id, label)
+
+    # Write hooks, registered with on_commit
+
+    async def book_changed(self, book_id: int, title: str):
+        self.apply("books", book_id, title)
+
+    async def books_added(self, titles: dict[int, str]):
+        for book_id, title in titles.items():
+            self.apply("books", book_id, title)
+
+    async def book_deleted(self, book_id: int):
+        self.apply("books", book_id, None)
+
+    async def author_changed(self, author_id: int, name: str):
+        self.apply("authors", author_id, name)
+
+    async def author_deleted(self, author_id: int):
+        self.apply("authors", author_id, None)
+
+    # Lookups
+
+    def suggest(self, prefix: str, limit: int) -> dict:
+        return {
+            "books": self.books.search(prefix, limit),
+            "authors": self.authors.search(prefix, limit)
+        }
+
+    @property
+    def nbytes(self) -> int:
+        return self.books.nbytes + self.authors.nbytes
+
+    def stats(self) -> dict:
+        return {
+            "built": self.built,
+            "books": len(self.books.labels),
+            "authors": len(self.authors.labels),
+            "keys": len(self.books.keys) + len(self.authors.keys),
+            "bytes": self.nbytes
+        }
+
+    # Background job
+
+    async def tick(self):
+        await self.rebuild()
+
+
+suggest_index = SuggestIndex(SUGGEST_REFRESH_INTERVAL, SUGGEST_KEY_LENGTH)
@@ -0,0 +1,110 @@
+import math
+import time
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+
+from fastapi import HTTPException, Request, status
+
+from config import (
+    AUTH_IP_RATE, AUTH_IP_BURST, AUTH_EMAIL_RATE, AUTH_EMAIL_BURST, HASH_CONCURRENCY,
+    RATE_LIMIT_BACKEND
+)
+from plugins import load_backend
+import metrics
+
+
+def too_many_requests(detail: str, retry_after: float) -> HTTPException:
+    return HTTPException(
+        status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+        detail=detail,
+        headers={"Retry-After": str(max(1, math.ceil(retry_after)))}
+    )
+
+
+class RateLimitBackend:
+    # Token bucket storage. Shared implementations (e.g. Redis with a Lua script) make
+    # the limits hold across workers; take() must refill and spend atomically
+    async def take(self, key: str, rate: float, burst: int) -> float:
+        """Spends one token, returns 0 when admitted or the seconds until one is available"""
+        raise NotImplementedError
+
+
+class InMemoryRateLimitBackend(RateLimitBackend):
+    def __init__(self, maxsize: int = 100_000):
+        self.maxsize = maxsize
+        self._buckets: OrderedDict[str, tuple[float, float]] = OrderedDict()
+
+    async def take(self, key: str, rate: float, burst: int) -> float:
+        now = time.monotonic()
+        tokens, updated = self._buckets.pop(key, (burst, now))
+        tokens = min(burst, tokens + (now - updated) * rate)
+        retry_after = 0.0
+        if tokens >= 1:
+            tokens -= 1
+        else:
+            retry_after = (1 - tokens) / rate
+        self._buckets[key] = (tokens, now)
+        # Idle buckets are full anyway, forgetting the oldest loses nothing
+        while len(self._buckets) > self.maxsize:
+            self._buckets.popitem(last=False)
+        return retry_after
+
+
+class AdmissionController:
+    # Checked before any bcrypt work, an over-budget client is answered with 429
+    # at the cost of a dictionary lookup instead of a hash
+    def __init__(
+        self,
+        backend: RateLimitBackend,
+        ip_rate: float,
+        ip_burst: int,
+        email_rate: float,
+        email_burst: int
+    ):
+        self.backend = backend
+        self.limits = {
+            "ip": (ip_rate, ip_burst),
+            "email": (email_rate, email_burst)
+        }
+
+    async def check(self, kind: str, value: str):
+        rate, burst = self.limits[kind]
+        if rate <= 0:
+            return
+        retry_after = await self.backend.take(f"auth:{kind}:{value}", rate, burst)
+        if retry_after > 0:
+            metrics.throttled_requests.inc(kind)
+            raise too_many_requests("Too many requests, try again later", retry_after)
+
+    async def admit(self, request: Request, email: str | None):
+        # X-Forwarded-For only replaces the peer address for proxies in FORWARDED_ALLOW_IPS
+        client = request.client.host if request.client is not None else "unknown"
+        await self.check("ip", client)
+        if email is not None:
+            await self.check("email", email.lower())
+
+
+class ConcurrencyLimit:
+    # Caps hashing work in flight in this process, requests beyond the cap are
+    # rejected rather than queued behind the hash pool
+    def __init__(self, limit: int):
+        self.limit = limit
+        self.active = 0
+
+    @asynccontextmanager
+    async def slot(self):
+        if self.limit > 0 and self.active >= self.limit:
+            metrics.throttled_requests.inc("hashing")
+            raise too_many_requests("Server is busy, try again later", 1)
+        self.active += 1
+        try:
+            yield
+        finally:
+            self.active -= 1
+
+
+admission = AdmissionController(
+    load_backend(RATE_LIMIT_BACKEND, InMemoryRateLimitBackend),
+    AUTH_IP_RATE, AUTH_IP_BURST, AUTH_EMAIL_RATE, AUTH_EMAIL_BURST
+)
+hashing_limit = ConcurrencyLimit(HASH_CONCURRENCY)
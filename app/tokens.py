@@ -0,0 +1,93 @@
+import hashlib
+import time
+from collections import OrderedDict
+
+
+def token_key(token: str) -> str:
+    return hashlib.sha256(token.encode()).hexdigest()
+
+
+class TokenCache:
+    def __init__(self, maxsize: int):
+        self.maxsize = maxsize
+        self._items: OrderedDict[str, tuple[dict, float]] = OrderedDict()
+
+    def get(self, key: str) -> dict | None:
+        entry = self._items.get(key)
+        if entry is None:
+            return None
+        payload, expires_at = entry
+        if expires_at <= time.time():
+            del self._items[key]
+            return None
+        self._items.move_to_end(key)
+        return payload
+
+    def set(self, key: str, payload: dict, expires_at: float):
+        self._items[key] = (payload, expires_at)
+        self._items.move_to_end(key)
+        while len(self._items) > self.maxsize:
+            self._items.popitem(last=False)
+
+    def discard(self, key: str):
+        self._items.pop(key, None)
+
+    def clear(self):
+        self._items.clear()
+
+    def __len__(self):
+        return len(self._items)
+
+
+class RevocationBackend:
+    # Shared implementations (e.g. Redis, revocation.DatabaseRevocationBackend) override
+    # these; entries only need to live until `expires_at`, after which the token is
+    # rejected as expired anyway
+    async def revoke_token(self, key: str, expires_at: float):
+        raise NotImplementedError
+
+    async def revoke_user_tokens(self, user_id: int, issued_before: float, expires_at: float):
+        raise NotImplementedError
+
+    async def is_revoked(self, key: str, user_id: int, issued_at: float) -> bool:
+        raise NotImplementedError
+
+    # Started and stopped by the lifespan, for backends with background work
+    def start(self):
+        pass
+
+    async def stop(self):
+        pass
+
+
+class InMemoryRevocationBackend(RevocationBackend):
+    def __init__(self):
+        self._tokens: dict[str, float] = {}
+        self._users: dict[int, tuple[float, float]] = {}
+
+    def _purge(self):
+        now = time.time()
+        self._tokens = {key: exp for key, exp in self._tokens.items() if exp > now}
+        self._users = {
+            user_id: entry for user_id, entry in self._users.items() if entry[1] > now
+        }
+
+    async def revoke_token(self, key: str, expires_at: float):
+        self._purge()
+        self._tokens[key] = expires_at
+
+    async def revoke_user_tokens(self, user_id: int, issued_before: float, expires_at: float):
+        self._purge()
+        self._add_user(user_id, issued_before, expires_at)
+
+    def _add_user(self, user_id: int, issued_before: float, expires_at: float):
+        # The later cutoff wins, it covers every token the earlier one did
+        entry = self._users.get(user_id)
+        if entry is None or entry[0] < issued_before:
+            self._users[user_id] = (issued_before, expires_at)
+
+    async def is_revoked(self, key: str, user_id: int, issued_at: float) -> bool:
+        if key in self._tokens:
+            return True
+        entry = self._users.get(user_id)
+        return entry is not None and issued_at <= entry[0]
@@ -0,0 +1,244 @@
+"""Reproducible load test: seeds a synthetic catalog and drives the ASGI app in-process.
+
+    python bench/run.py --books 20000 --concurrency 32 --requests 2000 --output result.json
+
+Without --dsn a fresh SQLite file is used; pass a Postgres DSN together with --reset to
+benchmark against a real server (the schema is dropped and recreated).
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import sys
+import tempfile
+import time
+from collections import Counter
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--dsn", help="SQLAlchemy async DSN, a temporary SQLite file by default")
+    parser.add_argument("--reset", action="store_true", help="drop existing tables before seeding")
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument("--authors", type=int, default=500)
+    parser.add_argument("--genres", type=int, default=30)
+    parser.add_argument("--books", type=int, default=10000)
+    parser.add_argument("--rentals", type=int, default=2000)
+    parser.add_argument("--hot-books", type=int, default=5, help="books shared by the rent/return scenario")
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--requests", type=int, default=500, help="requests per scenario")
+    parser.add_argument("--warmup", type=int, default=20, help="unmeasured requests per scenario")
+    parser.add_argument("--scenarios", default=",".join(SCENARIOS), help="comma separated list")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--bcrypt-rounds", type=int, default=4, help="cost of seeded password hashes")
+    parser.add_argument("--output", help="write the JSON report to this file instead of stdout")
+    return parser.parse_args(argv)
+
+
+def percentile(values: list[float], fraction: float) -> float:
+    # Nearest-rank percentile, stable for small samples
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    rank = max(1, int(round(fraction * len(ordered) + 0.5)))
+    return ordered[min(rank, len(ordered)) - 1]
+
+
+class Context:
+    def __init__(self, client, catalog: dict, tokens: dict, args):
+        self.client = client
+        self.catalog = catalog
+        self.tokens = tokens
+        self.args = args
+
+    def auth(self, user_id: int) -> dict:
+        return {"Authorization": f"Bearer {self.tokens[user_id]}"}
+
+
+async def login(ctx: Context, rng: random.Random):
+    from seed import PASSWORD
+    user_id = rng.choice(ctx.catalog["user_ids"])
+    return [await ctx.client.post(
+        "/api/v1/login/", json={"email": f"reader{user_id - 2}@example.com", "password": PASSWORD}
+    )]
+
+async def search_title(ctx: Context, rng: random.Random):
+    return [await ctx.client.get("/api/v1/books/", params={"title": rng.choice(ctx.catalog["words"])})]
+
+async def search_author(ctx: Context, rng: random.Random):
+    return [await ctx.client.get("/api/v1/books/", params={"author": rng.choice(ctx.catalog["words"])})]
+
+async def search_genre(ctx: Context, rng: random.Random):
+    return [await ctx.client.get("/api/v1/books/", params={"genre": rng.choice(ctx.catalog["genre_names"])})]
+
+async def search_year(ctx: Context, rng: random.Random):
+    return [await ctx.client.get("/api/v1/books/", params={"release_year": rng.randint(1900, 2024)})]
+
+async def search_q(ctx: Context, rng: random.Random):
+    words = " ".join(rng.sample(ctx.catalog["words"], 2))
+    return [await ctx.client.get("/api/v1/books/", params={"q": words})]
+
+async def book_detail(ctx: Context, rng: random.Random):
+    return [await ctx.client.get(f"/api/v1/books/{rng.randint(1, ctx.catalog['books'])}")]
+
+async def my_profile(ctx: Context, rng: random.Random):
+    user_id = rng.choice(ctx.catalog["user_ids"])
+    return [await ctx.client.get("/api/v1/my_profile/", headers=ctx.auth(user_id))]
+
+async def rent_return(ctx: Context, rng: random.Random):
+    # Many readers fight over a handful of books, rent then return the same copy
+    book_id = rng.randint(1, min(ctx.args.hot_books, ctx.catalog["books"]))
+    user_id = rng.choice(ctx.catalog["user_ids"])
+    path = f"/api/v1/books/{book_id}/users/{user_id}"
+    headers = ctx.auth(1)
+    rented = await ctx.client.post(path, headers=headers)
+    if rented.status_code != 200 or rented.json().get("status") != "ok":
+        return [rented]
+    return [rented, await ctx.client.delete(path, headers=headers)]
+
+SCENARIOS = {
+    "login": login,
+    "search_title": search_title,
+    "search_author": search_author,
+    "search_genre": search_genre,
+    "search_year": search_year,
+    "search_q": search_q,
+    "book_detail": book_detail,
+    "my_profile": my_profile,
+    "rent_return": rent_return,
+}
+
+
+async def run_scenario(ctx: Context, name: str, seed: int) -> dict:
+    from querycount import QueryCounter
+    from models import engine
+
+    scenario = SCENARIOS[name]
+    rng = random.Random(f"{seed}:{name}")
+    for _ in range(ctx.args.warmup):
+        await scenario(ctx, rng)
+
+    latencies: list[float] = []
+    statuses: Counter = Counter()
+    errors = 0
+    remaining = ctx.args.requests
+
+    async def worker():
+        nonlocal remaining, errors
+        while remaining > 0:
+            remaining -= 1
+            started = time.perf_counter()
+            try:
+                responses = await scenario(ctx, rng)
+            except Exception:
+                errors += 1
+                continue
+            latencies.append(time.perf_counter() - started)
+            for response in responses:
+                statuses[response.status_code] += 1
+                if response.status_code >= 500:
+                    errors += 1
+
+    with QueryCounter(engine) as queries:
+        started = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(ctx.args.concurrency)))
+        elapsed = time.perf_counter() - started
+    completed = len(latencies)
+    return {
+        "requests": completed,
+        "errors": errors,
+        "elapsed_s": round(elapsed, 4),
+        "throughput_rps": round(completed / elapsed, 2) if elapsed else 0.0,
+        "latency_ms": {
+            "mean": round(sum(latencies) / completed * 1000, 3) if completed else 0.0,
+            "p50": round(percentile(latencies, 0.50) * 1000, 3),
+            "p95": round(percentile(latencies, 0.95) * 1000, 3),
+            "p99": round(percentile(latencies, 0.99) * 1000, 3),
+            "max": round(max(latencies, default=0.0) * 1000, 3),
+        },
+        "statuses": {str(code): count for code, count in sorted(statuses.items())},
+        "queries_per_request": round(queries.count / completed, 2) if completed else 0.0,
+    }
+
+
+async def main(args) -> dict:
+    import httpx
+    from sqlalchemy import select, text
+    import auth
+    from app import app
+    from migrations import schema_version
+    from models import Base, User, engine
+    from seed import seed_catalog
+
+    scenarios = [name.strip() for name in args.scenarios.split(",") if name.strip()]
+    unknown = set(scenarios) - set(SCENARIOS)
+    if unknown:
+        raise SystemExit(f"Unknown scenarios: {', '.join(sorted(unknown))}")
+
+    if args.reset:
+        async with engine.begin() as conn:
+            await conn.run_sync(Base.metadata.drop_all)
+            await conn.run_sync(schema_version.drop, checkfirst=True)
+            # Created by migration 2 next to the models' tables
+            if conn.dialect.name == "sqlite":
+                await conn.execute(text("DROP TABLE IF EXISTS books_fts"))
+    report = {"scenarios": {}}
+    async with app.router.lifespan_context(app):
+        started = time.perf_counter()
+        catalog = await seed_catalog(
+            engine, args.users, args.authors, args.genres, args.books, args.rentals,
+            seed=args.seed, bcrypt_rounds=args.bcrypt_rounds
+        )
+        seeded = time.perf_counter() - started
+        async with engine.connect() as conn:
+            roles = dict((await conn.execute(select(User.id, User.role))).all())
+        tokens = {user_id: auth.create_token({"id": user_id, "role": role}) for user_id, role in roles.items()}
+        transport = httpx.ASGITransport(app=app, raise_app_exceptions=False)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+            ctx = Context(client, catalog, tokens, args)
+            for name in scenarios:
+                report["scenarios"][name] = await run_scenario(ctx, name, args.seed)
+    await engine.dispose()
+    report["setup"] = {
+        "dialect": engine.dialect.name,
+        "python": platform.python_version(),
+        "seed": args.seed,
+        "seed_s": round(seeded, 3),
+        "concurrency": args.concurrency,
+        "requests_per_scenario": args.requests,
+        "catalog": {key: catalog[key] for key in ("users", "authors", "genres", "books", "rentals")},
+    }
+    return report
+
+
+def configure(args):
+    # The app reads its settings at import time, so the environment comes first
+    if args.dsn is None:
+        path = Path(tempfile.mkdtemp(prefix="library-bench-")) / "bench.db"
+        args.dsn = f"sqlite+aiosqlite:///{path}"
+    os.environ["DATABASE_URL"] = args.dsn
+    os.environ.setdefault("SECRET_KEY", "benchmark-secret")
+    os.environ.setdefault("DB_STARTUP", "migrate")
+    os.environ.setdefault("BCRYPT_ROUNDS", str(args.bcrypt_rounds))
+    os.environ.setdefault("DB_POOL_SIZE", str(args.concurrency))
+    # One client address and a handful of emails would trip the auth rate limits at once
+    os.environ.setdefault("AUTH_IP_RATE", "0")
+    os.environ.setdefault("AUTH_EMAIL_RATE", "0")
+    os.environ.setdefault("HASH_CONCURRENCY", "0")
+    sys.path[:0] = [str(ROOT / "app"), str(ROOT / "bench")]
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    configure(args)
+    report = asyncio.run(main(args))
+    output = json.dumps(report, indent=2)
+    if args.output:
+        Path(args.output).write_text(output + "\n")
+    else:
+        print(output)
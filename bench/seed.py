@@ -0,0 +1,113 @@
+import datetime
+import random
+
+from sqlalchemy import insert, update
+
+from models import Author, Book, Genre, User, UserRole, book_author, book_genre, book_user
+from hashing import hash_password
+from config import MAX_RENTED_BOOKS, RENT_PERIOD_DAYS
+from migrations import backfill_stats
+
+
+WORDS = (
+    "shadow river night garden silent empire winter glass storm forgotten iron "
+    "golden city last light ocean stone secret king queen fire dream broken star "
+    "hidden road wolf crown forest north song blood memory island tower dark lost"
+).split()
+GENRES = (
+    "fantasy", "science fiction", "mystery", "thriller", "romance", "horror", "history",
+    "biography", "poetry", "drama", "adventure", "classics", "philosophy", "travel"
+)
+PASSWORD = "benchmark1"
+CHUNK = 5000
+
+
+def title(rng: random.Random) -> str:
+    return " ".join(rng.choice(WORDS) for _ in range(rng.randint(2, 5))).capitalize()
+
+async def insert_chunked(conn, table, rows: list[dict]):
+    for start in range(0, len(rows), CHUNK):
+        chunk = rows[start:start + CHUNK]
+        if chunk:
+            await conn.execute(insert(table), chunk)
+
+async def seed_catalog(
+    engine,
+    users: int,
+    authors: int,
+    genres: int,
+    books: int,
+    rentals: int,
+    seed: int = 0,
+    bcrypt_rounds: int = 4
+) -> dict:
+    rng = random.Random(seed)
+    # Every seeded user shares one password, hashing it per user would dominate seeding
+    password = hash_password(PASSWORD, bcrypt_rounds)
+    genre_names = [GENRES[i % len(GENRES)] + (f" {i // len(GENRES)}" if i >= len(GENRES) else "")
+                   for i in range(genres)]
+    stock = [rng.randint(1, 10) for _ in range(books)]
+    async with engine.begin() as conn:
+        await insert_chunked(conn, User.__table__, [
+            {"id": 1, "name": "admin", "email": "admin@example.com",
+             "password": password, "role": UserRole.admin}
+        ] + [
+            {"id": i + 2, "name": f"reader {i}", "email": f"reader{i}@example.com",
+             "password": password, "role": UserRole.user}
+            for i in range(users)
+        ])
+        await insert_chunked(conn, Author.__table__, [
+            {"id": i + 1, "name": f"{rng.choice(WORDS).capitalize()} {rng.choice(WORDS).capitalize()}",
+             "biography": "Synthetic author", "date_of_birth": datetime.datetime(1900 + i % 100, 1, 1)}
+            for i in range(authors)
+        ])
+        await insert_chunked(conn, Genre.__table__, [
+            {"id": i + 1, "name": name} for i, name in enumerate(genre_names)
+        ])
+        await insert_chunked(conn, Book.__table__, [
+            {"id": i + 1, "title": title(rng), "description": title(rng),
+             "release_year": rng.randint(1900, 2024), "available_stock": stock[i]}
+            for i in range(books)
+        ])
+        await insert_chunked(conn, book_author, [
+            {"book_id": i + 1, "author_id": author_id}
+            for i in range(books)
+            for author_id in rng.sample(range(1, authors + 1), min(authors, rng.randint(1, 2)))
+        ])
+        await insert_chunked(conn, book_genre, [
+            {"book_id": i + 1, "genre_id": genre_id}
+            for i in range(books)
+            for genre_id in rng.sample(range(1, genres + 1), min(genres, rng.randint(1, 3)))
+        ])
+        now = datetime.datetime.now()
+        rented: dict[int, set[int]] = {}
+        rows = []
+        for _ in range(rentals * 3):
+            if len(rows) >= rentals:
+                break
+            user_id = rng.randint(2, users + 1)
+            book_id = rng.randint(1, books)
+            user_books = rented.setdefault(user_id, set())
+            if stock[book_id - 1] == 0 or book_id in user_books or len(user_books) >= MAX_RENTED_BOOKS:
+                continue
+            stock[book_id - 1] -= 1
+            user_books.add(book_id)
+            rent_date = now - datetime.timedelta(days=rng.randint(0, 2 * RENT_PERIOD_DAYS))
+            rows.append({
+                "book_id": book_id, "user_id": user_id, "rent_date": rent_date,
+                "return_date": rent_date + datetime.timedelta(days=RENT_PERIOD_DAYS)
+            })
+        await insert_chunked(conn, book_user, rows)
+        for book_id in {row["book_id"] for row in rows}:
+            await conn.execute(
+                update(Book.__table__)
+                .where(Book.__table__.c.id == book_id)
+                .values(available_stock=stock[book_id - 1])
+            )
+        # Raw inserts bypass the write paths, recompute the summaries once
+        await backfill_stats(conn)
+    return {
+        "users": users, "authors": authors, "genres": genres, "books": books,
+        "rentals": len(rows), "words": WORDS, "genre_names": genre_names,
+        "author_ids": range(1, authors + 1), "user_ids": range(2, users + 2)
+    }
@@ -0,0 +1,98 @@
+"""Micro-benchmark of response serialization, per item cost of each path.
+
+    python bench/serialization.py --items 1,20,100 --repeat 200
+
+"model" is what FastAPI does with a response_model: validate the ORM objects into
+pydantic models, dump them to JSON-compatible Python and json.dumps the result.
+"fast" is the encoder path from app/serialize.py.
+"""
+import argparse
+import datetime
+import json
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "app"))
+
+from fastapi.encoders import jsonable_encoder
+from pydantic import TypeAdapter
+
+from models import Author, Book, Genre, User
+from schema import AuthorSchema, GetBook, GetUserDetails, Page
+from serialize import author_record, book_record, dump, page_encoder, user_details_record
+
+
+def make_book(i: int) -> Book:
+    return Book(
+        id=i, title=f"Book title {i}", description="A fairly ordinary description " * 4,
+        release_year=1900 + i % 120, available_stock=i % 7,
+        authors=[Author(id=i, name=f"Author {i}"), Author(id=i + 1, name=f"Author {i + 1}")],
+        genres=[Genre(id=i % 10, name=f"genre {i % 10}")]
+    )
+
+def make_author(i: int) -> Author:
+    return Author(
+        id=i, name=f"Author {i}", biography="Biography " * 10,
+        date_of_birth=datetime.datetime(1900 + i % 100, 1, 1)
+    )
+
+def make_user(i: int, books: list[Book]) -> User:
+    return User(id=i, name=f"User {i}", email=f"user{i}@example.com", role="user", books=books)
+
+def model_path(response_model):
+    # What fastapi.routing.serialize_response and JSONResponse do
+    adapter = TypeAdapter(response_model)
+    def run(data):
+        value = adapter.validate_python(data, from_attributes=True)
+        content = jsonable_encoder(adapter.dump_python(value, mode="json"))
+        return json.dumps(content, ensure_ascii=False, separators=(",", ":")).encode()
+    return run
+
+def fast_path(encode):
+    return lambda data: dump(encode(data))
+
+def measure(run, data, repeat: int) -> float:
+    run(data)
+    started = time.perf_counter()
+    for _ in range(repeat):
+        run(data)
+    return (time.perf_counter() - started) / repeat
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--items", default="1,20,100", help="page sizes, comma separated")
+    parser.add_argument("--repeat", type=int, default=200)
+    args = parser.parse_args(argv)
+
+    cases = {
+        "book_page": (Page[GetBook], book_record, lambda n: {
+            "items": [make_book(i) for i in range(n)], "next_cursor": "eyJpZCI6MX0"
+        }, True),
+        "author_page": (Page[AuthorSchema], author_record, lambda n: {
+            "items": [make_author(i) for i in range(n)], "next_cursor": None
+        }, True),
+        "user_details": (GetUserDetails, user_details_record, lambda n: make_user(
+            1, [make_book(i) for i in range(n)]
+        ), False),
+    }
+    report = {}
+    for name, (response_model, encode, build, paged) in cases.items():
+        model, fast = model_path(response_model), fast_path(page_encoder(encode) if paged else encode)
+        report[name] = {}
+        for n in (int(value) for value in args.items.split(",")):
+            data = build(n)
+            if model(data) != fast(data):
+                raise SystemExit(f"{name}: fast path output differs from the response model")
+            model_s, fast_s = measure(model, data, args.repeat), measure(fast, data, args.repeat)
+            report[name][str(n)] = {
+                "model_us_per_item": round(model_s / max(n, 1) * 1e6, 3),
+                "fast_us_per_item": round(fast_s / max(n, 1) * 1e6, 3),
+                "speedup": round(model_s / fast_s, 2),
+            }
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,67 @@
+import os
+import sys
+import tempfile
+from pathlib import Path
+
+import pytest
+
+ROOT = Path(__file__).resolve().parent.parent
+
+# The app reads its settings at import time, so the environment comes first. The
+# same SQLite setup as bench/run.py; every response cache lookup is a miss so the
+# handlers' own queries are counted.
+os.environ["DATABASE_URL"] = (
+    f"sqlite+aiosqlite:///{Path(tempfile.mkdtemp(prefix='library-tests-')) / 'tests.db'}"
+)
+os.environ["DB_STARTUP"] = "migrate"
+os.environ["RESPONSE_CACHE_TTL"] = "0"
+os.environ.setdefault("SECRET_KEY", "test-secret")
+os.environ.setdefault("BCRYPT_ROUNDS", "4")
+os.environ.setdefault("AUTH_IP_RATE", "0")
+os.environ.setdefault("AUTH_EMAIL_RATE", "0")
+os.environ.setdefault("HASH_CONCURRENCY", "0")
+os.environ.setdefault("OVERDUE_SCAN_INTERVAL", "0")
+sys.path[:0] = [str(ROOT / "app"), str(ROOT / "bench")]
+
+
+@pytest.fixture(scope="session")
+def anyio_backend():
+    return "asyncio"
+
+
+@pytest.fixture(scope="session")
+async def catalog():
+    from app import app
+    from models import engine
+    from seed import seed_catalog
+    from similar import similar_books
+    from suggest import suggest_index
+
+    async with app.router.lifespan_context(app):
+        # The index rebuilds share the engine and would show up in the counts
+        await similar_books.stop()
+        await suggest_index.stop()
+        yield await seed_catalog(
+            engine, users=20, authors=10, genres=5, books=50, rentals=30, bcrypt_rounds=4
+        )
+    await engine.dispose()
+
+
+@pytest.fixture(scope="session")
+async def client(catalog):
+    import httpx
+    from app import app
+
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://tests") as client:
+        yield client
+
+
+@pytest.fixture
+def auth():
+    from auth import create_token
+    from models import UserRole
+
+    def headers(user_id: int, role: UserRole = UserRole.user) -> dict:
+        return {"Authorization": f"Bearer {create_token({'id': user_id, 'role': role})}"}
+    return headers
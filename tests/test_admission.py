@@ -0,0 +1,25 @@
+import pytest
+
+from throttle import admission
+
+pytestmark = pytest.mark.anyio
+
+
+@pytest.mark.parametrize("path", ["/api/v1/login/", "/api/v1/register/", "/api/v1/admin_register/"])
+@pytest.mark.parametrize("content, headers", [
+    (b"", {}),
+    (b"garbage", {"Content-Type": "text/plain"}),
+    (b"{not json", {"Content-Type": "application/json"}),
+])
+async def test_malformed_body(client, path, content, headers):
+    response = await client.post(path, content=content, headers=headers)
+    assert response.status_code == 422
+
+async def test_throttled_email(client, monkeypatch):
+    monkeypatch.setitem(admission.limits, "email", (0.01, 1))
+    credentials = {"email": "throttled@example.com", "password": "wrong-password"}
+    first = await client.post("/api/v1/login/", json=credentials)
+    assert first.status_code != 429
+    second = await client.post("/api/v1/login/", json=credentials)
+    assert second.status_code == 429
+    assert int(second.headers["Retry-After"]) >= 1
@@ -0,0 +1,79 @@
+import pytest
+from sqlalchemy import func, select
+
+from config import MAX_RENTED_BOOKS
+from models import Book, UserRole, book_user, engine
+from querycount import assert_max_queries
+
+pytestmark = pytest.mark.anyio
+
+
+async def user_with_books() -> int:
+    async with engine.connect() as conn:
+        return await conn.scalar(
+            select(book_user.c.user_id)
+            .group_by(book_user.c.user_id)
+            .order_by(func.count().desc(), book_user.c.user_id)
+            .limit(1)
+        )
+
+async def free_rental(catalog: dict) -> tuple[int, int]:
+    # A book in stock and a user below the limit who does not have it yet
+    async with engine.connect() as conn:
+        rented = dict((await conn.execute(
+            select(book_user.c.user_id, func.count()).group_by(book_user.c.user_id)
+        )).all())
+        user_id = next(
+            user_id for user_id in catalog["user_ids"] if rented.get(user_id, 0) < MAX_RENTED_BOOKS
+        )
+        book_id = await conn.scalar(
+            select(Book.id)
+            .where(
+                Book.available_stock > 0,
+                Book.id.not_in(select(book_user.c.book_id).where(book_user.c.user_id == user_id))
+            )
+            .order_by(Book.id)
+            .limit(1)
+        )
+    return book_id, user_id
+
+
+# Page, authors and genres: the count does not grow with the page size
+@pytest.mark.parametrize("params", [{}, {"limit": 100}, {"title": "a"}])
+async def test_get_books(client, params):
+    with assert_max_queries(engine, 3):
+        response = await client.get("/api/v1/books/", params=params)
+    assert response.status_code == 200
+    assert response.json()["items"]
+
+async def test_get_books_by_genre(client, catalog):
+    with assert_max_queries(engine, 3):
+        response = await client.get("/api/v1/books/", params={"genre": catalog["genre_names"][0]})
+    assert response.status_code == 200
+    assert response.json()["items"]
+
+async def test_get_book(client):
+    with assert_max_queries(engine, 3):
+        response = await client.get("/api/v1/books/1")
+    assert response.status_code == 200
+    assert response.json()["authors"]
+
+async def test_my_profile(client, auth):
+    user_id = await user_with_books()
+    with assert_max_queries(engine, 4):
+        response = await client.get("/api/v1/my_profile/", headers=auth(user_id))
+    assert response.status_code == 200
+    assert len(response.json()["books"]) > 1
+
+# SQLite: the conditional UPDATE and the loan row are separate statements, plus the
+# statistics and co-rental updates (Postgres folds each pair into one CTE)
+async def test_rent_and_return(client, catalog, auth):
+    book_id, user_id = await free_rental(catalog)
+    path = f"/api/v1/books/{book_id}/users/{user_id}"
+    admin = auth(1, UserRole.admin)
+    with assert_max_queries(engine, 5):
+        response = await client.post(path, headers=admin)
+    assert response.json() == {"status": "ok"}
+    with assert_max_queries(engine, 4):
+        response = await client.delete(path, headers=admin)
+    assert response.json() == {"status": "ok"}
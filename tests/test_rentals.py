@@ -0,0 +1,47 @@
+import asyncio
+
+import pytest
+from sqlalchemy import func, select
+
+from config import MAX_RENTED_BOOKS
+from models import Book, UserRole, book_user, engine
+
+pytestmark = pytest.mark.anyio
+
+
+async def reader_without_books(catalog: dict) -> int:
+    async with engine.connect() as conn:
+        holders = set(await conn.scalars(select(book_user.c.user_id).distinct()))
+    return next(user_id for user_id in catalog["user_ids"] if user_id not in holders)
+
+async def books_in_stock(count: int) -> list[int]:
+    async with engine.connect() as conn:
+        return list(await conn.scalars(
+            select(Book.id).where(Book.available_stock > 0).order_by(Book.id).limit(count)
+        ))
+
+async def loans(user_id: int) -> int:
+    async with engine.connect() as conn:
+        return await conn.scalar(
+            select(func.count()).select_from(book_user).where(book_user.c.user_id == user_id)
+        )
+
+
+async def test_parallel_checkouts_respect_the_limit(client, catalog, auth):
+    # One slot left, two different books rented at once: exactly one gets it
+    user_id = await reader_without_books(catalog)
+    book_ids = await books_in_stock(MAX_RENTED_BOOKS + 1)
+    admin = auth(1, UserRole.admin)
+    for book_id in book_ids[:MAX_RENTED_BOOKS - 1]:
+        response = await client.post(f"/api/v1/books/{book_id}/users/{user_id}", headers=admin)
+        assert response.json() == {"status": "ok"}
+
+    responses = await asyncio.gather(*(
+        client.post(f"/api/v1/books/{book_id}/users/{user_id}", headers=admin)
+        for book_id in book_ids[MAX_RENTED_BOOKS - 1:]
+    ))
+
+    assert sorted(response.status_code for response in responses) == [200, 400]
+    assert await loans(user_id) == MAX_RENTED_BOOKS
+    for book_id in book_ids:
+        await client.delete(f"/api/v1/books/{book_id}/users/{user_id}", headers=admin)
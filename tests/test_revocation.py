@@ -0,0 +1,36 @@
+import time
+
+import pytest
+from sqlalchemy import select
+
+from models import RevokedToken, engine
+from revocation import DatabaseRevocationBackend
+
+pytestmark = pytest.mark.anyio
+
+
+# Two backends stand in for two workers sharing the database
+async def test_revocations_reach_other_workers(catalog):
+    first, second = DatabaseRevocationBackend(), DatabaseRevocationBackend()
+    await second.tick()
+    now = time.time()
+    await first.revoke_token("token-key", now + 60)
+    await first.revoke_user_tokens(7, now, now + 60)
+    assert await first.is_revoked("token-key", 1, now)
+    assert not await second.is_revoked("token-key", 1, now)
+    await second.tick()
+    assert await second.is_revoked("token-key", 1, now)
+    assert await second.is_revoked("other-key", 7, now - 1)
+    assert not await second.is_revoked("other-key", 7, now + 1)
+    # A fresh worker loads the live list on its first sync
+    third = DatabaseRevocationBackend()
+    await third.tick()
+    assert await third.is_revoked("token-key", 1, now)
+
+async def test_expired_revocations_are_dropped(catalog):
+    backend = DatabaseRevocationBackend()
+    await backend.revoke_token("expired-key", time.time() - 1)
+    await backend.revoke_token("live-key", time.time() + 60)
+    async with engine.connect() as conn:
+        keys = set(await conn.scalars(select(RevokedToken.token_key)))
+    assert "live-key" in keys and "expired-key" not in keys